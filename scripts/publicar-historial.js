@@ -0,0 +1,53 @@
+// Genera en el build el snapshot con hash del historial. No se versiona en
+// git: se deriva de public/historial.json, que update_historial.py escribe
+// byte a byte igual al snapshot publicado. La compresión (gzip/brotli) la
+// hace el hosting al servirlo.
+import { createHash } from "node:crypto";
+import {
+  existsSync,
+  mkdirSync,
+  readFileSync,
+  readdirSync,
+  unlinkSync,
+  writeFileSync,
+} from "node:fs";
+
+const publicDir = new URL("../public/", import.meta.url);
+const historialDir = new URL("historial/", publicDir);
+const punteroUrl = new URL("latest.json", historialDir);
+
+const contenido = readFileSync(new URL("historial.json", publicDir));
+const version = createHash("sha256").update(contenido).digest("hex").slice(0, 16);
+const nombre = `historial.${version}.json`;
+
+mkdirSync(historialDir, { recursive: true });
+
+// Solo el snapshot vigente
+for (const archivo of readdirSync(historialDir)) {
+  if (archivo.startsWith("historial.") && !archivo.startsWith(nombre)) {
+    unlinkSync(new URL(archivo, historialDir));
+  }
+}
+
+writeFileSync(new URL(nombre, historialDir), contenido);
+
+// Si historial.json se editó a mano el puntero ya no corresponde: sin delta
+const puntero = existsSync(punteroUrl)
+  ? JSON.parse(readFileSync(punteroUrl, "utf-8"))
+  : null;
+if (puntero?.version !== version) {
+  console.warn(`latest.json no apunta a ${version}; se publica sin delta`);
+  writeFileSync(
+    punteroUrl,
+    JSON.stringify({
+      version,
+      archivo: `/historial/${nombre}`,
+      bytes: contenido.length,
+      ultima_actualizacion: puntero?.ultima_actualizacion ?? null,
+      delta: null,
+      delta_base: null,
+    })
+  );
+}
+
+console.log(`historial publicado: ${nombre} (${(contenido.length / 1024).toFixed(1)} KB)`);
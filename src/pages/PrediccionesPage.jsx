@@ -20,16 +20,171 @@ import {
   PolarRadiusAxis,
 } from "recharts";
 
+// =========================
+// Carga del historial publicado
+// =========================
+// latest.json apunta al snapshot con hash (cacheable para siempre) y al
+// delta contra la versión anterior. Si el navegador ya guardó esa versión
+// anterior, solo se descargan las filas nuevas.
+const CLAVE_CACHE_HISTORIAL = "historial-publicado";
+
+function aplicarDelta(base, delta) {
+  const empresas = base.empresas.map((e) => ({ ...e }));
+  for (const cambio of delta.empresas) {
+    const { historico_nuevo, historico_desde, ...campos } = cambio;
+    let empresa = empresas.find((e) => e.ticker === cambio.ticker);
+    if (!empresa) {
+      empresa = { historico: [] };
+      empresas.push(empresa);
+    }
+    const primeraNueva = historico_nuevo.length
+      ? historico_nuevo[0].fecha
+      : null;
+    empresa.historico = (empresa.historico ?? [])
+      .filter(
+        (r) =>
+          (!historico_desde || r.fecha >= historico_desde) &&
+          (!primeraNueva || r.fecha < primeraNueva)
+      )
+      .concat(historico_nuevo);
+    Object.assign(empresa, campos);
+  }
+  return { ...base, ...delta.secciones, empresas };
+}
+
+async function cargarHistorial() {
+  try {
+    const puntero = await fetch("/historial/latest.json", {
+      cache: "no-cache",
+    }).then((res) => res.json());
+
+    let guardado = null;
+    try {
+      guardado = JSON.parse(localStorage.getItem(CLAVE_CACHE_HISTORIAL));
+    } catch {
+      guardado = null;
+    }
+
+    if (guardado?.version === puntero.version) return guardado.data;
+
+    let data;
+    if (guardado && puntero.delta && puntero.delta_base === guardado.version) {
+      const delta = await fetch(puntero.delta).then((res) => res.json());
+      data = aplicarDelta(guardado.data, delta);
+    } else {
+      data = await fetch(puntero.archivo).then((res) => res.json());
+    }
+
+    try {
+      localStorage.setItem(
+        CLAVE_CACHE_HISTORIAL,
+        JSON.stringify({ version: puntero.version, data })
+      );
+    } catch {
+      // Sin espacio en localStorage: la próxima vez se baja completo
+    }
+    return data;
+  } catch {
+    // Sin artefactos publicados todavía: archivo plano de siempre
+    return fetch("/historial.json").then((res) => res.json());
+  }
+}
+
+// Lo que se carga primero: el índice de empresas (sin histórico, con las
+// últimas filas) y las series reducidas del ticker que se está viendo.
+// El historial completo solo se pide al abrir «Detalle».
+async function cargarIndice() {
+  try {
+    const res = await fetch("/historial/series/index.json", {
+      cache: "no-cache",
+    });
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
+    return await res.json();
+  } catch {
+    // Sin índice publicado: historial completo (trae el histórico)
+    return cargarHistorial();
+  }
+}
+
+async function cargarSeries(ticker) {
+  const res = await fetch(`/historial/series/${ticker}.json`, {
+    cache: "no-cache",
+  });
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  return (await res.json()).series;
+}
+
+// Totales de los resúmenes compactados (filas diarias viejas)
+function totalesResumenes(empresa) {
+  const resumenes = [
+    ...(empresa?.resumen_mensual ?? []),
+    ...(empresa?.resumen_semanal ?? []),
+  ];
+  return resumenes.reduce(
+    (acc, r) => ({
+      evaluados: acc.evaluados + (r.evaluados ?? 0),
+      aciertos: acc.aciertos + (r.aciertos ?? 0),
+      sumaError: acc.sumaError + (r.error_medio_pct ?? 0) * (r.evaluados ?? 0),
+    }),
+    { evaluados: 0, aciertos: 0, sumaError: 0 }
+  );
+}
+
+// Error medio y tasa de acierto de una empresa. El índice ya los trae
+// calculados; con el historial completo se calculan aquí, SOLO tomando filas
+// donde sí hubo predicción (precio_predicho) y error_pct numérico
+function desempenoEmpresa(empresa, historico = empresa?.historico ?? []) {
+  if (empresa?.desempeno) {
+    const d = empresa.desempeno;
+    return {
+      errorMedio: d.error_medio_pct,
+      aciertos: d.aciertos,
+      tasaAciertos: d.tasa_aciertos_pct,
+      totalEvaluados: d.evaluados,
+    };
+  }
+
+  const previos = totalesResumenes(empresa);
+  const valid = historico.filter(
+    (d) =>
+      typeof d.error_pct === "number" &&
+      !Number.isNaN(d.error_pct) &&
+      d.precio_predicho != null
+  );
+  const totalEvaluados = valid.length + previos.evaluados;
+
+  if (!totalEvaluados) {
+    return { errorMedio: 0, aciertos: 0, tasaAciertos: 0, totalEvaluados: 0 };
+  }
+
+  const sumError = valid.reduce(
+    (acc, d) => acc + Math.abs(d.error_pct || 0),
+    previos.sumaError
+  );
+  const aciertos = valid.filter((d) => d.acierto).length + previos.aciertos;
+
+  return {
+    errorMedio: sumError / totalEvaluados,
+    aciertos,
+    tasaAciertos: (aciertos / totalEvaluados) * 100,
+    totalEvaluados,
+  };
+}
+
 function PrediccionesPage() {
   const [datos, setDatos] = useState(null);
   const [tickerSeleccionado, setTickerSeleccionado] = useState("");
+  // Rango de las gráficas: series reducidas (1M/6M/all) o el histórico completo
+  const [rangoSerie, setRangoSerie] = useState("all");
+  // Series reducidas por ticker e historial completo (solo para «Detalle»)
+  const [seriesPorTicker, setSeriesPorTicker] = useState({});
+  const [historialCompleto, setHistorialCompleto] = useState(null);
 
   // =========================
-  // Cargar historial.json
+  // Cargar el índice de empresas
   // =========================
   useEffect(() => {
-    fetch("/historial.json")
-      .then((res) => res.json())
+    cargarIndice()
       .then((data) => {
         setDatos(data);
         if (data.empresas && data.empresas.length > 0) {
@@ -41,6 +196,32 @@ function PrediccionesPage() {
       });
   }, []);
 
+  // Series del ticker seleccionado (una vez por ticker)
+  useEffect(() => {
+    if (!tickerSeleccionado || seriesPorTicker[tickerSeleccionado]) return;
+    cargarSeries(tickerSeleccionado)
+      .then((series) =>
+        setSeriesPorTicker((previas) => ({
+          ...previas,
+          [tickerSeleccionado]: series,
+        }))
+      )
+      .catch(() => {
+        // Sin series publicadas: las gráficas usan el histórico
+      });
+  }, [tickerSeleccionado, seriesPorTicker]);
+
+  // Historial completo: solo al abrir «Detalle» y si el índice no lo trae
+  const conHistorico = Boolean(datos?.empresas?.[0]?.historico);
+  useEffect(() => {
+    if (rangoSerie !== "detalle" || historialCompleto || conHistorico) return;
+    cargarHistorial()
+      .then(setHistorialCompleto)
+      .catch((err) => {
+        console.error("Error al cargar historial.json", err);
+      });
+  }, [rangoSerie, historialCompleto, conHistorico]);
+
   // =========================
   // Helpers
   // =========================
@@ -88,7 +269,13 @@ function PrediccionesPage() {
     );
   }, [empresas, tickerSeleccionado]);
 
-  const historico = empresa?.historico ?? [];
+  // Histórico completo si ya se cargó; si no, las últimas filas del índice
+  const historicoCompleto =
+    empresa?.historico ??
+    historialCompleto?.empresas?.find((e) => e.ticker === empresa?.ticker)
+      ?.historico ??
+    null;
+  const historico = historicoCompleto ?? empresa?.recientes ?? [];
   const ultimaFila =
     historico.length > 0 ? historico[historico.length - 1] : null;
 
@@ -97,45 +284,37 @@ function PrediccionesPage() {
   // =========================
 
   // Error medio & tasa de acierto para empresa seleccionada
-  // SOLO tomando filas donde sí hubo predicción (precio_predicho) y error_pct numérico
-  const { errorMedio, aciertos, tasaAciertos, totalEvaluados } = useMemo(() => {
-    if (!historico.length) {
-      return { errorMedio: 0, aciertos: 0, tasaAciertos: 0, totalEvaluados: 0 };
-    }
-
-    const valid = historico.filter(
-      (d) =>
-        typeof d.error_pct === "number" &&
-        !Number.isNaN(d.error_pct) &&
-        d.precio_predicho != null
-    );
-    const totalEvaluados = valid.length;
-
-    if (!totalEvaluados) {
-      return { errorMedio: 0, aciertos: 0, tasaAciertos: 0, totalEvaluados: 0 };
-    }
-
-    const sumError = valid.reduce(
-      (acc, d) => acc + Math.abs(d.error_pct || 0),
-      0
-    );
-    const errorMedio = sumError / totalEvaluados;
-
-    const aciertos = valid.filter((d) => d.acierto).length;
-    const tasaAciertos = (aciertos / totalEvaluados) * 100;
+  // (incluye los resúmenes semanales/mensuales de filas ya compactadas)
+  const { errorMedio, aciertos, tasaAciertos, totalEvaluados } = useMemo(
+    () => desempenoEmpresa(empresa, historico),
+    [historico, empresa]
+  );
 
-    return { errorMedio, aciertos, tasaAciertos, totalEvaluados };
-  }, [historico]);
+  // Series precalculadas por el backend (≤300 puntos por rango).
+  // Si no existen o se pide "detalle", se usa el histórico completo.
+  const seriesRango =
+    rangoSerie !== "detalle"
+      ? seriesPorTicker[empresa?.ticker]?.[rangoSerie] ?? null
+      : null;
 
   // Datos para gráfico principal: precio real vs predicción
   const datosPrecioChart = useMemo(() => {
+    if (seriesRango) {
+      // Un eje de fechas por rango; null donde el campo no tiene dato
+      return seriesRango.fechas.map((fecha, i) => ({
+        fecha,
+        real: seriesRango.precio_real[i],
+        prediccion: seriesRango.precio_predicho[i],
+      }));
+    }
+
     return historico.map((d) => ({
       fecha: d.fecha,
       real: typeof d.precio_real === "number" ? d.precio_real : null,
       prediccion:
         typeof d.precio_predicho === "number" ? d.precio_predicho : null,
     }));
-  }, [historico]);
+  }, [historico, seriesRango]);
 
   // Sparkline de últimos N días (precio real)
   const sparklineData = useMemo(() => {
@@ -152,40 +331,25 @@ function PrediccionesPage() {
 
   // Gráfico de error diario
   const errorChartData = useMemo(() => {
+    if (seriesRango) {
+      return seriesRango.fechas
+        .map((fecha, i) => ({ fecha, error: seriesRango.error_pct[i] }))
+        .filter((d) => d.error != null)
+        .map((d) => ({ ...d, acierto: Math.abs(d.error) <= 2 ? 1 : 0 }));
+    }
+
     return historico.map((d) => ({
       fecha: d.fecha,
       error: typeof d.error_pct === "number" ? d.error_pct : 0,
       acierto: d.acierto ? 1 : 0,
     }));
-  }, [historico]);
+  }, [historico, seriesRango]);
 
   // Comparativa entre empresas (tasa de acierto y error medio)
   const comparacionEmpresas = useMemo(() => {
     if (!empresas.length) return [];
     return empresas.map((e) => {
-      const hist = e.historico ?? [];
-      if (!hist.length)
-        return {
-          ticker: e.ticker,
-          nombre: e.nombre ?? e.ticker,
-          tasaAciertos: 0,
-          errorMedio: 0,
-        };
-      const valid = hist.filter(
-        (d) =>
-          typeof d.error_pct === "number" &&
-          !Number.isNaN(d.error_pct) &&
-          d.precio_predicho != null
-      );
-      const sumError = valid.reduce(
-        (acc, d) => acc + Math.abs(d.error_pct || 0),
-        0
-      );
-      const errorMedio = valid.length > 0 ? sumError / valid.length : 0;
-      const aciertos = valid.filter((d) => d.acierto).length;
-      const tasaAciertos =
-        valid.length > 0 ? (aciertos / valid.length) * 100 : 0;
-
+      const { tasaAciertos, errorMedio } = desempenoEmpresa(e);
       return {
         ticker: e.ticker,
         nombre: e.nombre ?? e.ticker,
@@ -526,9 +690,31 @@ function PrediccionesPage() {
         <div className="flex flex-col gap-4">
           {/* Precio real vs predicción */}
           <div className="rounded-2xl border border-slate-200 bg-white p-4 shadow-sm min-h-[260px]">
-            <h2 className="text-sm font-semibold text-slate-900 mb-2">
-              Precio real vs predicción
-            </h2>
+            <div className="flex items-center justify-between gap-2 mb-2">
+              <h2 className="text-sm font-semibold text-slate-900">
+                Precio real vs predicción
+              </h2>
+              <div className="flex gap-1">
+                {[
+                  ["1M", "1M"],
+                  ["6M", "6M"],
+                  ["all", "Todo"],
+                  ["detalle", "Detalle"],
+                ].map(([valor, etiqueta]) => (
+                  <button
+                    key={valor}
+                    onClick={() => setRangoSerie(valor)}
+                    className={`px-2 py-0.5 rounded-full text-xs border transition-colors ${
+                      rangoSerie === valor
+                        ? "bg-blue-600 text-white border-blue-600"
+                        : "bg-white text-slate-700 border-slate-300 hover:bg-slate-50"
+                    }`}
+                  >
+                    {etiqueta}
+                  </button>
+                ))}
+              </div>
+            </div>
             {datosPrecioChart.length > 0 ? (
               <ResponsiveContainer width="100%" height={260}>
                 <LineChart data={datosPrecioChart}>
@@ -544,6 +730,7 @@ function PrediccionesPage() {
                     name="Real"
                     strokeWidth={2}
                     dot={false}
+                    connectNulls
                   />
                   <Line
                     type="monotone"
@@ -552,6 +739,7 @@ function PrediccionesPage() {
                     name="Predicción"
                     strokeWidth={2}
                     dot={false}
+                    connectNulls
                   />
                 </LineChart>
               </ResponsiveContainer>
@@ -665,6 +853,12 @@ function PrediccionesPage() {
         <h2 className="text-sm font-semibold text-slate-900 mb-2">
           Historial de esta empresa
         </h2>
+        {!historicoCompleto && historico.length > 0 && (
+          <p className="text-xs text-slate-500 mb-2">
+            Últimos {historico.length} días. Usa «Detalle» en la gráfica de
+            precio para cargar el historial completo.
+          </p>
+        )}
         {historico.length === 0 ? (
           <p className="text-sm text-slate-500">Sin datos.</p>
         ) : (
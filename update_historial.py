@@ -12,7 +12,7 @@ import warnings
 warnings.filterwarnings('ignore')
 
 # Machine Learning
-from sklearn.linear_model import LinearRegression
+from sklearn.linear_model import Ridge
 
 # Análisis Técnico
 import ta
@@ -31,10 +31,195 @@ FORECAST_DAYS = 7
 # =========================
 # 1. CARGA Y PREPARACIÓN DE DATOS
 # =========================
-def prepare_advanced_data(ticker):
+import os
+
+# Barras diarias en disco: cada corrida solo descarga lo que falta
+BARRAS_DIR = "data/barras"
+# Días que se vuelven a pedir al refrescar (yfinance revisa las últimas barras)
+BARRAS_REVISION_DIAS = 5
+COLUMNAS_OHLCV = ['Open', 'High', 'Low', 'Close', 'Volume']
+# Diferencia relativa en el cierre más viejo re-descargado que delata un ajuste
+# por split/dividendo (yfinance reescala toda la historia, no solo la cola)
+BARRAS_TOLERANCIA_AJUSTE = 1e-5
+
+# Resolución -> frecuencia de periodo de pandas (None = diario tal cual)
+RESOLUCIONES = {"D": None, "W": "W-FRI", "M": "M"}
+
+_barras_diarias = {}      # ticker -> DataFrame OHLCV diario
+_barras_frescas = set()   # tickers ya refrescados en este proceso
+_cache_remuestreo = {}    # (ticker, resolución) -> {"barras", "desde"}
+
+
+def prepare_advanced_data(ticker, resolucion="D"):
     print("📥 Cargando y procesando datos...")
-    df = yf.download(ticker, start=START_DATE, end=END_DATE, progress=False)
+    return calcular_indicadores(barras_en_resolucion(ticker, resolucion))
+
+
+def _normalizar_ohlcv(df):
+    """Columnas planas OHLCV, índice de fechas sin zona horaria y sin filas vacías"""
+    if isinstance(df.columns, pd.MultiIndex):
+        df = df.copy()
+        df.columns = df.columns.get_level_values(0)
+    df = df[COLUMNAS_OHLCV].dropna(subset=['Close']).astype(float)
+    indice = pd.DatetimeIndex(df.index)
+    if indice.tz is not None:
+        indice = indice.tz_localize(None)
+    df.index = indice.normalize().rename("Date")
+    return df[~df.index.duplicated(keep="last")].sort_index()
+
+
+def _ruta_barras(ticker):
+    return os.path.join(BARRAS_DIR, f"{ticker}.csv")
+
+
+def _leer_barras_disco(ticker):
+    if not os.path.exists(_ruta_barras(ticker)):
+        return None
+    return pd.read_csv(_ruta_barras(ticker), index_col=0, parse_dates=True,
+                       float_precision="round_trip")
+
+
+def agregar_barras_diarias(ticker, nuevas, reemplazar=False):
+    """
+    Mezcla barras diarias (nuevas o revisadas) en la caché del ticker y marca
+    las resoluciones derivadas para recalcular desde la primera barra que cambió.
+    Con reemplazar=True la historia en caché se descarta por completo.
+    """
+    nuevas = _normalizar_ohlcv(nuevas)
+    previas = None if reemplazar else _barras_diarias.get(ticker)
+    if previas is None or previas.empty:
+        _barras_diarias[ticker] = nuevas
+        desde = nuevas.index[0] if len(nuevas) else None
+    else:
+        solapadas = previas.reindex(nuevas.index)
+        cambiadas = ~(solapadas == nuevas).all(axis=1)
+        if not cambiadas.any():
+            return previas
+        desde = nuevas.index[cambiadas.to_numpy()][0]
+        _barras_diarias[ticker] = pd.concat(
+            [previas[~previas.index.isin(nuevas.index)], nuevas]).sort_index()
+
+    if desde is not None:
+        for (tk, _), entrada in _cache_remuestreo.items():
+            if tk == ticker:
+                entrada["desde"] = desde if entrada["desde"] is None else min(entrada["desde"], desde)
+    return _barras_diarias[ticker]
+
+
+def _historia_reescalada(previas, descarga):
+    """
+    True si la cola re-descargada ya no coincide con la caché en su barra más
+    vieja: yfinance ajustó precios (split/dividendo) y toda la historia previa
+    quedó en otra escala, no solo las barras solapadas.
+    """
+    nuevas = _normalizar_ohlcv(descarga)
+    comunes = previas.index.intersection(nuevas.index)
+    if comunes.empty:
+        return False
+    antes = previas.at[comunes[0], 'Close']
+    ahora = nuevas.at[comunes[0], 'Close']
+    return abs(ahora / antes - 1) > BARRAS_TOLERANCIA_AJUSTE
+
+
+def cargar_barras_diarias(ticker):
+    """
+    OHLCV diario del ticker: memoria -> disco -> yfinance. Solo se descargan
+    las barras posteriores a la caché (más unos días de revisión), y una sola
+    vez por proceso.
+    """
+    if ticker in _barras_frescas:
+        if ticker not in _barras_diarias:
+            # Liberado por el pipeline por lotes: ya se refrescó, vuelve del disco sin red
+            en_disco = _leer_barras_disco(ticker)
+            if en_disco is not None:
+                agregar_barras_diarias(ticker, en_disco)
+        return _barras_diarias.get(ticker, pd.DataFrame(columns=COLUMNAS_OHLCV))
+
+    if ticker not in _barras_diarias:
+        en_disco = _leer_barras_disco(ticker)
+        if en_disco is not None:
+            agregar_barras_diarias(ticker, en_disco)
+
+    previas = _barras_diarias.get(ticker)
+    inicio = START_DATE
+    if previas is not None and len(previas) > BARRAS_REVISION_DIAS:
+        inicio = previas.index[-BARRAS_REVISION_DIAS].strftime("%Y-%m-%d")
+
+    descarga = yf.download(ticker, start=inicio, end=END_DATE, progress=False)
+    reemplazar = False
+    if (descarga is not None and len(descarga) and inicio != START_DATE
+            and _historia_reescalada(previas, descarga)):
+        # Mezclar dejaría un salto falso en la costura: se rehace la historia completa
+        print(f"🔁 {ticker}: precios ajustados por yfinance, se descarga la historia completa")
+        descarga = yf.download(ticker, start=START_DATE, end=END_DATE, progress=False)
+        reemplazar = True
+
+    if descarga is not None and len(descarga):
+        antes = _barras_diarias.get(ticker)
+        barras = agregar_barras_diarias(ticker, descarga, reemplazar)
+        if barras is not antes:
+            os.makedirs(BARRAS_DIR, exist_ok=True)
+            barras.to_csv(_ruta_barras(ticker))
+
+    _barras_frescas.add(ticker)
+    return _barras_diarias.get(ticker, pd.DataFrame(columns=COLUMNAS_OHLCV))
+
+
+def remuestrear(diarias, resolucion):
+    """
+    OHLCV diario -> semanal/mensual agrupando con reduceat (sin bucles ni
+    groupby). Cada periodo queda fechado con su última barra real, así que el
+    periodo en curso aparece con la fecha de hoy.
+    """
+    if RESOLUCIONES[resolucion] is None or diarias.empty:
+        return diarias
+
+    periodos = diarias.index.to_period(RESOLUCIONES[resolucion]).asi8
+    inicios = np.flatnonzero(np.r_[True, periodos[1:] != periodos[:-1]])
+    finales = np.r_[inicios[1:] - 1, len(diarias) - 1]
+
+    ohlcv = {col: diarias[col].to_numpy(dtype=float) for col in COLUMNAS_OHLCV}
+    return pd.DataFrame({
+        'Open': ohlcv['Open'][inicios],
+        'High': np.maximum.reduceat(ohlcv['High'], inicios),
+        'Low': np.minimum.reduceat(ohlcv['Low'], inicios),
+        'Close': ohlcv['Close'][finales],
+        'Volume': np.add.reduceat(ohlcv['Volume'], inicios),
+    }, index=diarias.index[finales])
+
 
+def actualizar_remuestreo(agregado, diarias, resolucion, desde):
+    """
+    Rehace solo los periodos a partir del que contiene `desde` (normalmente
+    el periodo abierto); los periodos cerrados anteriores se reutilizan.
+    """
+    if agregado is None or agregado.empty:
+        return remuestrear(diarias, resolucion)
+    inicio = pd.Timestamp(desde).to_period(RESOLUCIONES[resolucion]).start_time
+    return pd.concat([agregado[agregado.index < inicio],
+                      remuestrear(diarias[diarias.index >= inicio], resolucion)])
+
+
+def barras_en_resolucion(ticker, resolucion="D"):
+    """OHLCV del ticker en la resolución pedida, derivado de las barras diarias en caché"""
+    diarias = cargar_barras_diarias(ticker)
+    if RESOLUCIONES[resolucion] is None:
+        return diarias
+
+    clave = (ticker, resolucion)
+    entrada = _cache_remuestreo.get(clave)
+    if entrada is None:
+        barras = remuestrear(diarias, resolucion)
+    elif entrada["desde"] is not None:
+        barras = actualizar_remuestreo(entrada["barras"], diarias, resolucion, entrada["desde"])
+    else:
+        barras = entrada["barras"]
+    _cache_remuestreo[clave] = {"barras": barras, "desde": None}
+    return barras
+
+
+def calcular_indicadores(df):
+    """Indicadores técnicos sobre un DataFrame OHLCV ya descargado"""
     # Crear DataFrame de resultados
     result_df = pd.DataFrame(index=df.index)
 
@@ -69,7 +254,420 @@ def prepare_advanced_data(ticker):
     return result_df.dropna()
 
 # =========================
-# 2. SISTEMA COMPLETO DE PREDICCIÓN Y TRADING
+# 2. PREDICCIÓN, SEÑAL Y RIESGO
+# =========================
+class PredictorMezcla:
+    """
+    Predicción basada en múltiples métodos simples (el modelo original):
+    promedio móvil + regresión lineal de 20 días + momentum de 5 días.
+    Trabaja sobre una matriz tickers × cierres, así que predice en lote.
+    """
+    requiere_entrenamiento = False
+
+    def fit(self, X, y, days=7):
+        return self
+
+    def predict(self, X, days=7):
+        current = X[:, -1]
+        ventana = X.shape[1]
+
+        # Método 1: Promedio móvil
+        ma_pred = (X[:, -5:].mean(axis=1) + X[:, -10:].mean(axis=1)) / 2
+
+        # Método 2: Regresión lineal (forma cerrada, una pendiente por fila)
+        x = np.arange(ventana) - (ventana - 1) / 2
+        pendiente = X @ x / (x @ x)
+        lr_pred = X.mean(axis=1) + pendiente * (ventana - 1 + days - (ventana - 1) / 2)
+
+        # Método 3: Momentum (continuar tendencia de 5 días)
+        momentum = (current - X[:, -5]) / X[:, -5]
+        momentum_pred = current * (1 + momentum * days * 0.3)
+
+        # Combinar métodos
+        final_pred = (ma_pred * 0.4 + lr_pred * 0.4 + momentum_pred * 0.2)
+
+        # Predicción para cada día: avance lineal hacia el 80% del objetivo
+        progress = np.arange(1, days + 1) / days
+        return current[:, None] + (final_pred - current)[:, None] * progress * 0.8
+
+
+class PredictorRidge:
+    """
+    Ridge sobre los cierres normalizados por el precio actual; aprende el
+    retorno a `days` barras. Se entrena con muestras de muestras_entrenamiento.
+    """
+    requiere_entrenamiento = True
+
+    def __init__(self, alpha=1.0):
+        self.modelo = Ridge(alpha=alpha)
+        self.horizonte = None
+
+    def fit(self, X, y, days=7):
+        self.modelo.fit(X / X[:, -1:] - 1, y / X[:, -1] - 1)
+        self.horizonte = days
+        return self
+
+    def predict(self, X, days=7):
+        if self.horizonte is None:
+            raise ValueError("PredictorRidge necesita fit() antes de predict()")
+        current = X[:, -1]
+        # Retorno aprendido a `horizonte` barras, escalado al horizonte pedido
+        retorno = self.modelo.predict(X / X[:, -1:] - 1) * days / self.horizonte
+        progress = np.arange(1, days + 1) / days
+        return current[:, None] * (1 + retorno[:, None] * progress)
+
+
+# Modelos disponibles por nombre (se elige con PREDICTOR o --predictor)
+PREDICTORES = {
+    "mezcla": PredictorMezcla,
+    "ridge": PredictorRidge,
+}
+PREDICTOR = "mezcla"
+PREDICTOR_VENTANA = 20   # cierres que recibe cada modelo como features
+
+# Predicciones ya calculadas por (modelo, ticker, fecha, días, cierre, alcance).
+# El alcance dice con qué historia se entrenó el modelo: "panel" (el de la
+# corrida, predecir_lote) o "ticker" (solo la del ticker); no predicen igual
+_cache_predicciones = {}
+
+# Barras hacia atrás de las predicciones de validación de plot_calculated_vs_real
+VENTANAS_VALIDACION = range(30, 10, -3)
+# Barras finales de cada serie que no entran al entrenamiento de la corrida
+PREDICTOR_RESERVA = max(VENTANAS_VALIDACION)
+# Modelos entrenados una vez por corrida, por (predictor, días)
+_modelos_corrida = {}
+
+
+def crear_predictor(nombre=None):
+    nombre = nombre or PREDICTOR
+    if nombre not in PREDICTORES:
+        raise ValueError(f"Predictor desconocido: {nombre} (opciones: {', '.join(PREDICTORES)})")
+    return PREDICTORES[nombre]()
+
+
+def features_prediccion(cierres):
+    """Cierres (un ticker o una matriz tickers × tiempo) -> matriz tickers × features"""
+    cierres = np.atleast_2d(np.asarray(cierres, dtype=float))
+    return cierres[:, -PREDICTOR_VENTANA:]
+
+
+def muestras_entrenamiento(close, days):
+    """(X, y) desde un panel T × N: ventanas de cierres y el cierre `days` barras después"""
+    close = np.asarray(close, dtype=float)
+    if close.ndim == 1:
+        close = close[:, None]
+    if len(close) < PREDICTOR_VENTANA + days:
+        return np.empty((0, PREDICTOR_VENTANA)), np.empty(0)
+    ventanas = np.lib.stride_tricks.sliding_window_view(close, PREDICTOR_VENTANA, axis=0)
+    X = ventanas[:-days].reshape(-1, PREDICTOR_VENTANA)
+    y = close[PREDICTOR_VENTANA - 1 + days:].reshape(-1)
+    ok = ~np.isnan(X).any(axis=1) & ~np.isnan(y)
+    return X[ok], y[ok]
+
+
+def preparar_predictor(close, days, nombre=None):
+    """Crea el predictor y, si lo necesita, lo entrena con la historia dada"""
+    modelo = crear_predictor(nombre)
+    if modelo.requiere_entrenamiento:
+        X, y = muestras_entrenamiento(close, days)
+        if not len(y):
+            modelo = PredictorMezcla()  # sin historia suficiente para entrenar
+        else:
+            modelo.fit(X, y, days)
+    return modelo
+
+
+def entrenar_predictores(cierres, horizontes, nombre=None):
+    """
+    Entrena una vez por horizonte el predictor con las ventanas de todos los
+    tickers dados (lista de arrays de cierres, alineados al final). Cada serie
+    deja fuera sus últimas PREDICTOR_RESERVA barras: son las que se evalúan.
+    """
+    nombre = nombre or PREDICTOR
+    largo = max(len(c) for c in cierres)
+    panel = np.full((largo, len(cierres)), np.nan)
+    for j, c in enumerate(cierres):
+        panel[largo - len(c):, j] = c
+    panel = panel[:-PREDICTOR_RESERVA]
+    for days in horizontes:
+        _modelos_corrida[(nombre, days)] = preparar_predictor(panel, days, nombre)
+
+
+def predecir_lote(frames, days=FORECAST_DAYS):
+    """
+    Pronóstico y predicciones de validación de todos los tickers de un lote
+    ({ticker: df}): una matriz tickers × PREDICTOR_VENTANA y un solo predict
+    por horizonte. Quedan en _cache_predicciones con las mismas claves que
+    usa simple_price_prediction, así la etapa de señal no vuelve a predecir.
+    """
+    horizontes = {days: (0,), 1: VENTANAS_VALIDACION}
+    if any((PREDICTOR, h) not in _modelos_corrida for h in horizontes):
+        entrenar_predictores([df['Close'].to_numpy(dtype=float) for df in frames.values()],
+                             list(horizontes))
+
+    for horizonte, atras in horizontes.items():
+        claves, filas = [], []
+        for ticker, df in frames.items():
+            close = df['Close'].to_numpy(dtype=float)
+            for k in atras:
+                # Mismas condiciones que plot_calculated_vs_real
+                if k and not (k < len(df) - 10 and len(df) - k > 30):
+                    continue
+                fin = len(close) - k
+                claves.append((PREDICTOR, ticker, df.index[fin - 1], horizonte, close[fin - 1], "panel"))
+                filas.append(close[fin - PREDICTOR_VENTANA:fin])
+        if filas:
+            pred = _modelos_corrida[(PREDICTOR, horizonte)].predict(np.vstack(filas), horizonte)
+            for clave, fila in zip(claves, pred.tolist()):
+                _cache_predicciones[clave] = fila
+
+
+def alcance_prediccion(df, days=7, ticker=None):
+    """Alcance de la predicción en caché para esa barra: "panel" (modelo de la corrida) o "ticker"."""
+    clave = (PREDICTOR, ticker, df.index[-1], days, float(df['Close'].iloc[-1]), "panel")
+    return "panel" if ticker is not None and clave in _cache_predicciones else "ticker"
+
+
+def etiqueta_predictor(alcance):
+    """Predictor tal como se reporta: los que se entrenan llevan el alcance ("ridge@panel")"""
+    return f"{PREDICTOR}@{alcance}" if PREDICTORES[PREDICTOR].requiere_entrenamiento else PREDICTOR
+
+
+def simple_price_prediction(df, days=7, ticker=None):
+    """
+    Predicción de un ticker con el predictor configurado (PREDICTOR): la del
+    modelo de la corrida si predecir_lote ya la dejó en caché; si no, con un
+    modelo entrenado solo con la historia del ticker
+    """
+    close = df['Close'].to_numpy(dtype=float)
+
+    # El último cierre va en la clave para no confundir tickers ni barras revisadas
+    clave = (PREDICTOR, ticker, df.index[-1], days, close[-1])
+    if ticker is not None:
+        for alcance in ("panel", "ticker"):
+            if clave + (alcance,) in _cache_predicciones:
+                return list(_cache_predicciones[clave + (alcance,)])
+
+    modelo = preparar_predictor(close, days)
+    daily_predictions = modelo.predict(features_prediccion(close), days)[0].tolist()
+
+    if ticker is not None:
+        _cache_predicciones[clave + ("ticker",)] = daily_predictions
+    return list(daily_predictions)
+
+
+def generate_trading_signal(df, future_prices, current_price):
+    """Genera señal de compra/venta basada en análisis técnico mejorado"""
+
+    bb_position = (current_price - df['BB_lower'].iloc[-1]) / (df['BB_upper'].iloc[-1] - df['BB_lower'].iloc[-1])
+
+    return evaluar_senal(
+        rsi=df['RSI_14'].iloc[-1],
+        price_change=(future_prices[-1] - current_price) / current_price * 100,
+        volume_ratio=df['Volume_Ratio'].iloc[-1],
+        macd=df['MACD'].iloc[-1],
+        macd_signal_val=df['MACD_signal'].iloc[-1],
+        macd_histogram=df['MACD_histogram'].iloc[-1],
+        trend_5d=(df['Close'].iloc[-1] - df['Close'].iloc[-5]) / df['Close'].iloc[-5] * 100,
+        trend_20d=(df['Close'].iloc[-1] - df['Close'].iloc[-20]) / df['Close'].iloc[-20] * 100,
+        bb_position=bb_position,
+    )
+
+
+def evaluar_senal(rsi, price_change, volume_ratio, macd, macd_signal_val,
+                  macd_histogram, trend_5d, trend_20d, bb_position):
+    """Misma lógica de generate_trading_signal pero sobre valores escalares
+    (la usa también el modo streaming, que no mantiene un DataFrame)"""
+
+    # Factor 1: RSI (Mejorado)
+    rsi_signal = 0
+    if rsi < 30:
+        rsi_signal = 2  # Fuerte compra - sobreventa
+    elif rsi < 45:
+        rsi_signal = 1  # Compra moderada
+    elif rsi > 70:
+        rsi_signal = -2  # Fuerte venta - sobrecompra
+    elif rsi > 55:
+        rsi_signal = -1  # Venta moderada
+
+    # Factor 2: Tendencia de precio (CORREGIDO - comprar cuando sube)
+    price_signal = 0
+
+    # LÓGICA CORREGIDA: Comprar cuando sube, vender cuando baja
+    if price_change > 5:  # Fuerte tendencia alcista
+        price_signal = 3
+    elif price_change > 2:  # Tendencia alcista moderada
+        price_signal = 2
+    elif price_change > 0.5:  # Leve tendencia alcista
+        price_signal = 1
+    elif price_change < -5:  # Fuerte tendencia bajista
+        price_signal = -3
+    elif price_change < -2:  # Tendencia bajista moderada
+        price_signal = -2
+    elif price_change < -0.5:  # Leve tendencia bajista
+        price_signal = -1
+
+    # Factor 3: Volumen (Mejorado)
+    volume_signal = 0
+    if volume_ratio > 1.5:  # Volumen muy alto - confirmación
+        volume_signal = 2
+    elif volume_ratio > 1.2:  # Volumen alto
+        volume_signal = 1
+    elif volume_ratio < 0.7:  # Volumen muy bajo - precaución
+        volume_signal = -1
+    elif volume_ratio < 0.9:  # Volumen bajo
+        volume_signal = -0.5
+
+    # Factor 4: MACD (Mejorado)
+    macd_signal = 0
+    if macd > macd_signal_val and macd_histogram > 0:  # Fuerte tendencia alcista
+        macd_signal = 2
+    elif macd > macd_signal_val:  # Tendencia alcista
+        macd_signal = 1
+    elif macd < macd_signal_val and macd_histogram < 0:  # Fuerte tendencia bajista
+        macd_signal = -2
+    elif macd < macd_signal_val:  # Tendencia bajista
+        macd_signal = -1
+
+    # Factor 5: Tendencia a corto plazo
+    trend_signal = 0
+    if trend_5d > 2 and trend_20d > 1:  # Tendencia alcista confirmada
+        trend_signal = 2
+    elif trend_5d > 0 and trend_20d > 0:  # Tendencia alcista
+        trend_signal = 1
+    elif trend_5d < -2 and trend_20d < -1:  # Tendencia bajista confirmada
+        trend_signal = -2
+    elif trend_5d < 0 and trend_20d < 0:  # Tendencia bajista
+        trend_signal = -1
+
+    # Factor 6: Soporte y Resistencia
+    bb_signal = 0
+    if bb_position < 0.2:  # Cerca del soporte (banda inferior)
+        bb_signal = 1  # Señal de compra
+    elif bb_position > 0.8:  # Cerca de la resistencia (banda superior)
+        bb_signal = -1  # Señal de venta
+
+    # CÁLCULO DE SEÑAL TOTAL MEJORADO
+    total_signal = (rsi_signal + price_signal + volume_signal +
+                   macd_signal + trend_signal + bb_signal)
+
+    # LÓGICA DE DECISIÓN CORREGIDA
+    if total_signal >= 6:
+        return "🟢 COMPRAR FUERTE", total_signal, \
+               "Múltiples indicadores alcistas + tendencia fuerte + buen volumen"
+
+    elif total_signal >= 4:
+        return "🟢 COMPRAR", total_signal, \
+               "Señales alcistas moderadas con buena confirmación"
+
+    elif total_signal >= 2:
+        return "🟡 COMPRAR LEVE", total_signal, \
+               "Señales alcistas leves, considerar posición pequeña"
+
+    elif total_signal <= -6:
+        return "🔴 VENDER FUERTE", total_signal, \
+               "Múltiples indicadores bajistas + tendencia descendente fuerte"
+
+    elif total_signal <= -4:
+        return "🔴 VENDER", total_signal, \
+               "Señales bajistas moderadas, considerar tomar ganancias"
+
+    elif total_signal <= -2:
+        return "🟠 VENDER LEVE", total_signal, \
+               "Señales bajistas leves, considerar reducir posición"
+
+    else:
+        return "⚪ MANTENER", total_signal, \
+               "Mercado lateral o señales contradictorias, mantener posición actual"
+
+
+def calculate_risk_management(current_price, future_prices, signal):
+    """Calcula stop loss y take profit mejorado"""
+
+    if "COMPRAR" in signal:
+        # Para compras
+        stop_loss = current_price * 0.97  # -3%
+        take_profit = future_prices[-1]   # Precio objetivo final
+        risk_reward = (take_profit - current_price) / (current_price - stop_loss)
+
+        position_size = 'Alta' if "FUERTE" in signal else 'Moderada' if "COMPRAR" in signal else 'Leve'
+
+        return {
+            'stop_loss': stop_loss,
+            'take_profit': take_profit,
+            'risk_reward': risk_reward,
+            'risk_per_trade': '2% del capital',
+            'position_size': position_size
+        }
+    elif "VENDER" in signal:
+        # Para ventas
+        stop_loss = current_price * 1.03  # +3%
+        take_profit = future_prices[-1]
+        risk_reward = (stop_loss - current_price) / (current_price - take_profit)
+
+        position_size = 'Alta' if "FUERTE" in signal else 'Moderada' if "VENDER" in signal else 'Leve'
+
+        return {
+            'stop_loss': stop_loss,
+            'take_profit': take_profit,
+            'risk_reward': risk_reward,
+            'risk_per_trade': '2% del capital',
+            'position_size': position_size
+        }
+    else:
+        # Para mantener
+        return {
+            'stop_loss': None,
+            'take_profit': None,
+            'risk_reward': None,
+            'risk_per_trade': 'No operar',
+            'position_size': '0%'
+        }
+
+
+# Confirmación multi-temporal: resolución -> horizonte de predicción en barras
+CONFIRMACION_RESOLUCIONES = {"W": 2, "M": 1}
+# Filas mínimas con indicadores para evaluar una señal (tendencia 20 usa iloc[-20])
+MIN_FILAS_SENAL = 20
+
+
+def senal_en_resolucion(ticker, resolucion, days):
+    """Misma predicción + señal sobre barras semanales/mensuales (sin descargar nada)"""
+    df = calcular_indicadores(barras_en_resolucion(ticker, resolucion))
+    if len(df) < MIN_FILAS_SENAL:
+        return None
+
+    current_price = df['Close'].iloc[-1]
+    # El ticker lleva la resolución para no chocar en la caché con el diario
+    future_prices = simple_price_prediction(df, days, f"{ticker}@{resolucion}")
+    signal, total, _ = generate_trading_signal(df, future_prices, current_price)
+    return {"senal": signal, "fuerza": total, "barra": df.index[-1].date().isoformat()}
+
+
+def confirmacion_multitemporal(ticker, signal_strength):
+    """
+    Evalúa la señal en cada resolución de CONFIRMACION_RESOLUCIONES; la diaria
+    queda confirmada si todas apuntan en la misma dirección (mismos cortes ±2).
+    """
+    direccion = int(np.sign(nivel_senal(signal_strength)))
+    resoluciones = {}
+    for resolucion, days in CONFIRMACION_RESOLUCIONES.items():
+        resultado = senal_en_resolucion(ticker, resolucion, days)
+        if resultado is not None:
+            resoluciones[resolucion] = resultado
+
+    coinciden = sum(int(np.sign(nivel_senal(r["fuerza"]))) == direccion
+                    for r in resoluciones.values())
+    return {
+        "resoluciones": resoluciones,
+        "coinciden": coinciden,
+        "evaluadas": len(resoluciones),
+        "confirmada": bool(direccion != 0 and resoluciones and coinciden == len(resoluciones)),
+    }
+
+
+# =========================
+# 3. SISTEMA COMPLETO DE PREDICCIÓN Y TRADING
 # =========================
 def get_trading_signal_with_predictions(df):
     """Sistema completo con predicción y señal de trading MEJORADO"""
@@ -102,43 +700,8 @@ def get_trading_signal_with_predictions(df):
     # 2. PREDICCIÓN SIMPLE
     # =================================
 
-    def simple_price_prediction(df, days=7):
-        """Predicción basada en múltiples métodos simples"""
-
-        current = df['Close'].iloc[-1]
-
-        # Método 1: Promedio móvil
-        sma_5 = df['Close'].tail(5).mean()
-        sma_10 = df['Close'].tail(10).mean()
-        ma_pred = (sma_5 + sma_10) / 2
-
-        # Método 2: Regresión lineal últimos 20 días
-        recent = df['Close'].tail(20).values
-        X = np.arange(len(recent)).reshape(-1, 1)
-        y = recent
-        lr = LinearRegression()
-        lr.fit(X, y)
-        lr_pred = lr.predict([[len(recent) + days - 1]])[0]
-
-        # Método 3: Momentum (continuar tendencia reciente)
-        momentum = trend_5d / 100
-        momentum_pred = current * (1 + momentum * days * 0.3)
-
-        # Combinar métodos
-        final_pred = (ma_pred * 0.4 + lr_pred * 0.4 + momentum_pred * 0.2)
-
-        # Generar predicción para cada día
-        daily_predictions = []
-
-        for day in range(1, days + 1):
-            progress = day / days
-            day_price = current + (final_pred - current) * progress * 0.8
-            daily_predictions.append(day_price)
-
-        return daily_predictions
-
     # Generar predicciones
-    future_prices = simple_price_prediction(df, FORECAST_DAYS)
+    future_prices = simple_price_prediction(df, FORECAST_DAYS, TICKER)
 
     # Fechas futuras
     last_date = df.index[-1]
@@ -155,171 +718,21 @@ def get_trading_signal_with_predictions(df):
     # 3. SEÑAL DE TRADING INTELIGENTE
     # =================================
 
-    def generate_trading_signal(df, future_prices, current_price):
-        """Genera señal de compra/venta basada en análisis técnico mejorado"""
-
-        # Factor 1: RSI (Mejorado)
-        rsi = df['RSI_14'].iloc[-1]
-        rsi_signal = 0
-        if rsi < 30:
-            rsi_signal = 2  # Fuerte compra - sobreventa
-        elif rsi < 45:
-            rsi_signal = 1  # Compra moderada
-        elif rsi > 70:
-            rsi_signal = -2  # Fuerte venta - sobrecompra
-        elif rsi > 55:
-            rsi_signal = -1  # Venta moderada
-
-        # Factor 2: Tendencia de precio (CORREGIDO - comprar cuando sube)
-        price_change = (future_prices[-1] - current_price) / current_price * 100
-        price_signal = 0
-
-        # LÓGICA CORREGIDA: Comprar cuando sube, vender cuando baja
-        if price_change > 5:  # Fuerte tendencia alcista
-            price_signal = 3
-        elif price_change > 2:  # Tendencia alcista moderada
-            price_signal = 2
-        elif price_change > 0.5:  # Leve tendencia alcista
-            price_signal = 1
-        elif price_change < -5:  # Fuerte tendencia bajista
-            price_signal = -3
-        elif price_change < -2:  # Tendencia bajista moderada
-            price_signal = -2
-        elif price_change < -0.5:  # Leve tendencia bajista
-            price_signal = -1
-
-        # Factor 3: Volumen (Mejorado)
-        volume_ratio = df['Volume_Ratio'].iloc[-1]
-        volume_signal = 0
-        if volume_ratio > 1.5:  # Volumen muy alto - confirmación
-            volume_signal = 2
-        elif volume_ratio > 1.2:  # Volumen alto
-            volume_signal = 1
-        elif volume_ratio < 0.7:  # Volumen muy bajo - precaución
-            volume_signal = -1
-        elif volume_ratio < 0.9:  # Volumen bajo
-            volume_signal = -0.5
-
-        # Factor 4: MACD (Mejorado)
-        macd = df['MACD'].iloc[-1]
-        macd_signal_val = df['MACD_signal'].iloc[-1]
-        macd_histogram = df['MACD_histogram'].iloc[-1]
-
-        macd_signal = 0
-        if macd > macd_signal_val and macd_histogram > 0:  # Fuerte tendencia alcista
-            macd_signal = 2
-        elif macd > macd_signal_val:  # Tendencia alcista
-            macd_signal = 1
-        elif macd < macd_signal_val and macd_histogram < 0:  # Fuerte tendencia bajista
-            macd_signal = -2
-        elif macd < macd_signal_val:  # Tendencia bajista
-            macd_signal = -1
-
-        # Factor 5: Tendencia a corto plazo
-        trend_5d = (df['Close'].iloc[-1] - df['Close'].iloc[-5]) / df['Close'].iloc[-5] * 100
-        trend_20d = (df['Close'].iloc[-1] - df['Close'].iloc[-20]) / df['Close'].iloc[-20] * 100
-
-        trend_signal = 0
-        if trend_5d > 2 and trend_20d > 1:  # Tendencia alcista confirmada
-            trend_signal = 2
-        elif trend_5d > 0 and trend_20d > 0:  # Tendencia alcista
-            trend_signal = 1
-        elif trend_5d < -2 and trend_20d < -1:  # Tendencia bajista confirmada
-            trend_signal = -2
-        elif trend_5d < 0 and trend_20d < 0:  # Tendencia bajista
-            trend_signal = -1
-
-        # Factor 6: Soporte y Resistencia
-        bb_position = (current_price - df['BB_lower'].iloc[-1]) / (df['BB_upper'].iloc[-1] - df['BB_lower'].iloc[-1])
-        bb_signal = 0
-
-        if bb_position < 0.2:  # Cerca del soporte (banda inferior)
-            bb_signal = 1  # Señal de compra
-        elif bb_position > 0.8:  # Cerca de la resistencia (banda superior)
-            bb_signal = -1  # Señal de venta
-
-        # CÁLCULO DE SEÑAL TOTAL MEJORADO
-        total_signal = (rsi_signal + price_signal + volume_signal +
-                       macd_signal + trend_signal + bb_signal)
-
-        # LÓGICA DE DECISIÓN CORREGIDA
-        if total_signal >= 6:
-            return "🟢 COMPRAR FUERTE", total_signal, \
-                   "Múltiples indicadores alcistas + tendencia fuerte + buen volumen"
-
-        elif total_signal >= 4:
-            return "🟢 COMPRAR", total_signal, \
-                   "Señales alcistas moderadas con buena confirmación"
-
-        elif total_signal >= 2:
-            return "🟡 COMPRAR LEVE", total_signal, \
-                   "Señales alcistas leves, considerar posición pequeña"
-
-        elif total_signal <= -6:
-            return "🔴 VENDER FUERTE", total_signal, \
-                   "Múltiples indicadores bajistas + tendencia descendente fuerte"
-
-        elif total_signal <= -4:
-            return "🔴 VENDER", total_signal, \
-                   "Señales bajistas moderadas, considerar tomar ganancias"
-
-        elif total_signal <= -2:
-            return "🟠 VENDER LEVE", total_signal, \
-                   "Señales bajistas leves, considerar reducir posición"
-
-        else:
-            return "⚪ MANTENER", total_signal, \
-                   "Mercado lateral o señales contradictorias, mantener posición actual"
-
     signal, signal_strength, reasoning = generate_trading_signal(df, future_prices, current_price)
 
+    # Semanal/mensual salen de las barras diarias en caché; si el df no vino de
+    # la caché (p. ej. armado a mano) se siembra con sus propias columnas OHLCV
+    if TICKER not in _barras_diarias:
+        agregar_barras_diarias(TICKER, df[COLUMNAS_OHLCV])
+        _barras_frescas.add(TICKER)
+    multitemporal = confirmacion_multitemporal(TICKER, signal_strength)
+    print(f"🕰️ Confirmación multi-temporal: {multitemporal['coinciden']}/{multitemporal['evaluadas']} "
+          + " | ".join(f"{res}: {r['senal']}" for res, r in multitemporal['resoluciones'].items()))
+
     # =================================
     # 4. GESTIÓN DE RIESGO
     # =================================
 
-    def calculate_risk_management(current_price, future_prices, signal):
-        """Calcula stop loss y take profit mejorado"""
-
-        if "COMPRAR" in signal:
-            # Para compras
-            stop_loss = current_price * 0.97  # -3%
-            take_profit = future_prices[-1]   # Precio objetivo final
-            risk_reward = (take_profit - current_price) / (current_price - stop_loss)
-
-            position_size = 'Alta' if "FUERTE" in signal else 'Moderada' if "COMPRAR" in signal else 'Leve'
-
-            return {
-                'stop_loss': stop_loss,
-                'take_profit': take_profit,
-                'risk_reward': risk_reward,
-                'risk_per_trade': '2% del capital',
-                'position_size': position_size
-            }
-        elif "VENDER" in signal:
-            # Para ventas
-            stop_loss = current_price * 1.03  # +3%
-            take_profit = future_prices[-1]
-            risk_reward = (stop_loss - current_price) / (current_price - take_profit)
-
-            position_size = 'Alta' if "FUERTE" in signal else 'Moderada' if "VENDER" in signal else 'Leve'
-
-            return {
-                'stop_loss': stop_loss,
-                'take_profit': take_profit,
-                'risk_reward': risk_reward,
-                'risk_per_trade': '2% del capital',
-                'position_size': position_size
-            }
-        else:
-            # Para mantener
-            return {
-                'stop_loss': None,
-                'take_profit': None,
-                'risk_reward': None,
-                'risk_per_trade': 'No operar',
-                'position_size': '0%'
-            }
-
     risk_management = calculate_risk_management(current_price, future_prices, signal)
 
     bb_position = (current_price - df['BB_lower'].iloc[-1]) / (df['BB_upper'].iloc[-1] - df['BB_lower'].iloc[-1])
@@ -339,7 +752,7 @@ def get_trading_signal_with_predictions(df):
         prediction_errors = []
 
         # Probar el modelo en datos pasados
-        test_periods = range(30, 10, -3)  # Evaluar cada 3 días hacia atrás
+        test_periods = VENTANAS_VALIDACION  # Evaluar cada 3 días hacia atrás
 
         for days_ago in test_periods:
             if days_ago < len(df) - 10:
@@ -348,7 +761,7 @@ def get_trading_signal_with_predictions(df):
                 if len(past_data) > 30:
                     try:
                         # Hacer predicción para 1 día adelante
-                        predicted_price = simple_price_prediction(past_data, 1)[0]
+                        predicted_price = simple_price_prediction(past_data, 1, TICKER)[0]
                         actual_price = df['Close'].iloc[-days_ago + 1]
                         prediction_date = df.index[-days_ago + 1]
 
@@ -696,7 +1109,9 @@ Riesgo: {risk_management['risk_per_trade']}"""
     'reasoning': reasoning,
     'risk_management': risk_management,
     'model_accuracy': model_accuracy,
-    'avg_error': avg_error,                      
+    'avg_error': avg_error,
+    'predictor': etiqueta_predictor(alcance_prediccion(df, FORECAST_DAYS, TICKER)),
+    'multitemporal': multitemporal,
     'technical_analysis': {
         'rsi': rsi,
         'trend_5d': trend_5d,
@@ -712,18 +1127,6 @@ Riesgo: {risk_management['risk_per_trade']}"""
 # EJECUCIÓN DEL SISTEMA COMPLETO
 # =============================================
 
-def limpiar_valor(x):
-    """Convierte numpy types a tipos Python puros (JSON-safe)"""
-    import numpy as np
-    if isinstance(x, (np.floating,)):
-        return float(x)
-    if isinstance(x, (np.integer,)):
-        return int(x)
-    if isinstance(x, (np.bool_,)):
-        return bool(x)
-    return x
-
-
 def run_trading_system():
     """Ejecuta todo el sistema y regresa los resultados"""
     print("🚀 INICIANDO SISTEMA DE TRADING AVANZADO...")
@@ -745,47 +1148,383 @@ def run_trading_system():
 # EJECUTAR SISTEMA Y ACTUALIZAR JSON
 # =============================================
 import json
-import os
+import glob
+import hashlib
 from datetime import datetime, timezone, timedelta
 
 JSON_PATH = os.path.join("public", "historial.json")
 
+# Puntero y deltas diarios. El snapshot con hash no va a git:
+# los genera scripts/publicar-historial.js en el build a partir de JSON_PATH
+PUBLICACION_DIR = os.path.join("public", "historial")
+PUNTERO_PATH = os.path.join(PUBLICACION_DIR, "latest.json")
+
+# Lo que la página carga primero: índice de tarjetas y series reducidas por
+# ticker. El histórico completo (snapshot o delta) solo se pide en «Detalle»
+SERIES_DIR = os.path.join(PUBLICACION_DIR, "series")
+FILAS_RECIENTES = 20
+
 
 # -------------------------------------------------------------------
-# Función: limpia valores para evitar errores al serializar a JSON
+# SERIALIZACIÓN: numpy -> tipos JSON, NaN/inf -> null, escritura por empresa
 # -------------------------------------------------------------------
+# Listas numéricas a partir de este tamaño se convierten con numpy de un golpe
+_MIN_LISTA_NUMPY = 32
+
+
+def _arreglo_a_lista(arr):
+    """ndarray -> lista Python en una sola pasada (NaN/inf -> None)"""
+    if arr.dtype.kind == "f":
+        finitos = np.isfinite(arr)
+        if finitos.all():
+            return arr.tolist()
+        salida = arr.astype(object)
+        salida[~finitos] = None
+        return salida.tolist()
+    if arr.dtype.kind in "biu":
+        return arr.tolist()
+    return [a_json_seguro(v) for v in arr.tolist()]
+
+
+def a_json_seguro(obj):
+    """
+    Convierte recursivamente a tipos JSON puros: escalares y arreglos de
+    numpy, NaN/inf (-> None), fechas (-> ISO). Los tipos nativos pasan
+    sin costo y las listas numéricas largas se convierten en bloque.
+    """
+    tipo = type(obj)
+    if tipo is float:
+        return obj if obj - obj == 0 else None   # NaN e inf dan NaN al restar
+    if obj is None or tipo is str or tipo is int or tipo is bool:
+        return obj
+    if tipo is dict:
+        return {k: a_json_seguro(v) for k, v in obj.items()}
+    if tipo is list or tipo is tuple:
+        if len(obj) >= _MIN_LISTA_NUMPY:
+            arr = np.asarray(obj) if all(type(v) is float or type(v) is int for v in obj) else None
+            if arr is not None:
+                return _arreglo_a_lista(arr)
+        return [a_json_seguro(v) for v in obj]
+    if isinstance(obj, np.ndarray):
+        return _arreglo_a_lista(obj)
+    if isinstance(obj, np.generic):
+        return a_json_seguro(obj.item())
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    try:
+        return a_json_seguro(float(obj))
+    except (TypeError, ValueError):
+        return str(obj)
+
+
 def limpiar_valor(x):
-    if x is None:
-        return None
-    if isinstance(x, (int, float, str)):
-        return x
-    if isinstance(x, bool):
-        return 1 if x else 0
+    """Un valor suelto -> tipo JSON-seguro (ver a_json_seguro)"""
+    return a_json_seguro(x)
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return _arreglo_a_lista(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"{type(obj).__name__} no es serializable a JSON")
+
+
+def json_compacto(obj):
+    """
+    json.dumps minificado con el encoder en C. Si aparece un NaN/inf (que
+    JSON no admite) se limpia ese objeto con a_json_seguro y se reintenta.
+    """
     try:
-        return float(x)
-    except Exception:
-        return str(x)
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"),
+                          allow_nan=False, default=_json_default)
+    except ValueError:
+        return json.dumps(a_json_seguro(obj), ensure_ascii=False, separators=(",", ":"))
+
+
+def fragmentos_json(data):
+    """Genera el JSON del historial por partes: una empresa a la vez"""
+    yield "{"
+    primero = True
+    for clave, valor in data.items():
+        if not primero:
+            yield ","
+        primero = False
+        yield json.dumps(clave, ensure_ascii=False) + ":"
+        if clave == "empresas":
+            yield "["
+            for i, empresa in enumerate(valor):
+                yield ("," if i else "") + json_compacto(empresa)
+            yield "]"
+        else:
+            yield json_compacto(valor)
+    yield "}"
+
+
+def benchmark_serializacion(n=5000, filas=250):
+    """
+    Compara la ruta anterior (limpiar_valor campo por campo + json.dump con
+    indent=2 de toda la estructura) contra a_json_seguro + fragmentos_json,
+    con n empresas de `filas` días de histórico ya cargado del JSON.
+    """
+    import tempfile
+
+    def limpiar_legado(x):
+        # Copia de la versión anterior de limpiar_valor (solo para comparar)
+        if x is None:
+            return None
+        if isinstance(x, (int, float, str)):
+            return x
+        try:
+            return float(x)
+        except Exception:
+            return str(x)
+
+    rng = np.random.default_rng(0)
+    fechas = [d.date().isoformat() for d in pd.bdate_range(end=END_DATE, periods=filas)]
+
+    def empresa_sintetica(i):
+        precios = 100 + rng.standard_normal(filas).cumsum()
+        historico = [
+            {"fecha": f, "precio_real": float(p), "precio_predicho": float(p * 1.01),
+             "error_pct": 1.0, "acierto": True}
+            for f, p in zip(fechas, precios)
+        ]
+        estado = {f"campo_{k}": np.float64(rng.standard_normal()) for k in range(20)}
+        estado.update({"fuerza": np.int64(3), "volatilidad_pct": np.float64(np.nan),
+                       "senal": "⚪ MANTENER"})
+        return {"ticker": f"T{i:05d}", "nombre": f"Empresa {i}", "historico": historico,
+                "estado_actual": estado, "futuro": rng.standard_normal(FORECAST_DAYS)}
+
+    empresas = [empresa_sintetica(i) for i in range(n)]
+
+    def ruta_legado(destino):
+        t0 = time.perf_counter()
+        data = {"ultima_actualizacion": None, "empresas": []}
+        for e in empresas:
+            data["empresas"].append({
+                **e,
+                "estado_actual": {k: limpiar_legado(v) for k, v in e["estado_actual"].items()},
+                "futuro": [limpiar_legado(v) for v in e["futuro"]],
+            })
+        t1 = time.perf_counter()
+        with open(destino, "w", encoding="utf-8") as f:
+            # Sin allow_nan=False, igual que antes: NaN sale como NaN (JSON inválido)
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        return t1 - t0, time.perf_counter() - t1
+
+    def ruta_nueva(destino):
+        t0 = time.perf_counter()
+        data = {"ultima_actualizacion": None, "empresas": []}
+        for e in empresas:
+            data["empresas"].append({
+                **e,
+                "estado_actual": a_json_seguro(e["estado_actual"]),
+                "futuro": a_json_seguro(e["futuro"]),
+            })
+        t1 = time.perf_counter()
+        with open(destino, "w", encoding="utf-8") as f:
+            for fragmento in fragmentos_json(data):
+                f.write(fragmento)
+        return t1 - t0, time.perf_counter() - t1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        resultados = {}
+        for nombre, ruta in (("legado", ruta_legado), ("nuevo", ruta_nueva)):
+            destino = os.path.join(tmp, f"{nombre}.json")
+            conversion, escritura = ruta(destino)
+            resultados[nombre] = (conversion, escritura, os.path.getsize(destino))
+
+    print(f"\n⏱️ SERIALIZACIÓN: {n} empresas × {filas} filas")
+    print(f"   {'ruta':<8}{'conversión':>12}{'escritura':>12}{'total':>10}{'tamaño':>12}")
+    for nombre, (conversion, escritura, tamano) in resultados.items():
+        print(f"   {nombre:<8}{conversion:>11.3f}s{escritura:>11.3f}s"
+              f"{conversion + escritura:>9.3f}s{tamano / 1e6:>10.1f}MB")
+    return resultados
 
 
 # -------------------------------------------------------------------
 # CARGAR JSON EXISTENTE O CREAR UNO NUEVO
 # -------------------------------------------------------------------
 def cargar_historial():
+    contenido = None
     if os.path.exists(JSON_PATH):
-        with open(JSON_PATH, "r", encoding="utf-8") as f:
-            try:
-                data = json.load(f)
-            except Exception:
-                data = {"ultima_actualizacion": None, "empresas": []}
+        with open(JSON_PATH, "rb") as f:
+            contenido = f.read()
+        try:
+            data = json.loads(contenido)
+        except Exception:
+            data = {"ultima_actualizacion": None, "empresas": []}
+            contenido = None
     else:
         data = {"ultima_actualizacion": None, "empresas": []}
 
     if "empresas" not in data:
         data["empresas"] = []
 
+    # Las series ya no viven en el historial (van en SERIES_DIR)
+    for empresa in data["empresas"]:
+        empresa.pop("series", None)
+
+    # Si es la versión publicada, se guarda lo que necesita el delta de la
+    # próxima publicación (así no se vuelve a leer el archivo al guardar)
+    version = _version_publicada(contenido)
+    _publicado["version"] = version
+    _publicado["huellas"] = huellas_historial(data) if version else None
+
     return data
 
 
+# -------------------------------------------------------------------
+# GUARDAR EL JSON (con timestamp UTC)
+# -------------------------------------------------------------------
+def guardar_historial(data, publicar=True):
+    # Timestamp UTC con zona
+    data["ultima_actualizacion"] = datetime.now(timezone.utc).isoformat()
+
+    # Versión publicada anterior: la que dejó cargar_historial
+    base, anterior = (_publicado["version"], _publicado["huellas"]) if publicar else (None, None)
+
+    # Se escribe por empresa mientras se calcula el hash: el snapshot con
+    # hash del build es una copia byte a byte de este archivo
+    os.makedirs(os.path.dirname(JSON_PATH), exist_ok=True)
+    sha = hashlib.sha256()
+    total_bytes = 0
+    with open(JSON_PATH, "wb") as f:
+        for fragmento in fragmentos_json(data):
+            bloque = fragmento.encode("utf-8")
+            sha.update(bloque)
+            f.write(bloque)
+            total_bytes += len(bloque)
+
+    if publicar:
+        version = sha.hexdigest()[:16]
+        publicar_historial(data, version, total_bytes, base, anterior)
+        publicar_series(data, version)
+        # Un segundo guardado en el mismo proceso hace su delta contra este
+        _publicado["version"] = version
+        _publicado["huellas"] = huellas_historial(data)
+
+
+# -------------------------------------------------------------------
+# PUBLICACIÓN: puntero + delta diario (el snapshot con hash sale del build)
+# -------------------------------------------------------------------
+def _escribir_bytes(ruta, contenido):
+    with open(ruta, "wb") as f:
+        f.write(contenido)
+
+
+# Versión publicada que se cargó y las huellas de sus campos (cargar_historial)
+_publicado = {"version": None, "huellas": None}
+
+
+def _version_publicada(contenido):
+    """Versión de latest.json si `contenido` es ese snapshot, si no None"""
+    if contenido is None:
+        return None
+    try:
+        with open(PUNTERO_PATH, "r", encoding="utf-8") as f:
+            version = json.load(f).get("version")
+    except (OSError, ValueError, AttributeError):
+        return None
+    # Si el archivo no es el que publica el puntero, los clientes no lo tienen
+    return version if hashlib.sha256(contenido).hexdigest()[:16] == version else None
+
+
+def _huella(valor):
+    return hashlib.blake2b(json_compacto(valor).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def huellas_historial(data):
+    """
+    Lo que construir_delta necesita de la versión anterior: la última fecha
+    del histórico de cada empresa y una huella de cada uno de sus otros campos
+    y de cada sección.
+    """
+    return {
+        "secciones": {k: _huella(v) for k, v in data.items() if k != "empresas"},
+        "empresas": {
+            e["ticker"]: {
+                "ultima_fecha": (e.get("historico") or [{}])[-1].get("fecha"),
+                "campos": {k: _huella(v) for k, v in e.items() if k != "historico"},
+            }
+            for e in data["empresas"] if "ticker" in e
+        },
+    }
+
+
+def construir_delta(anterior, data, base, version):
+    """
+    Cambios de la versión `base` (sus huellas_historial, en `anterior`) ->
+    `data`: filas nuevas de histórico (desde la última fecha que ya tenían,
+    para cubrir re-corridas del mismo día) y el resto de campos reemplazados.
+    """
+    previas = anterior["empresas"]
+    empresas = []
+    for e in data["empresas"]:
+        historico = e.get("historico", [])
+        previa = previas.get(e["ticker"], {})
+        desde_base = previa.get("ultima_fecha")
+        nuevas = [r for r in historico if desde_base is None or r["fecha"] >= desde_base]
+        # Solo los campos que cambiaron (el estado, la predicción, los resúmenes...)
+        campos = previa.get("campos", {})
+        cambio = {k: v for k, v in e.items() if k != "historico" and campos.get(k) != _huella(v)}
+        cambio["ticker"] = e["ticker"]
+        cambio["historico_nuevo"] = nuevas
+        # Primera fecha que sigue en el histórico (por si se compactó)
+        cambio["historico_desde"] = historico[0]["fecha"] if historico else None
+        empresas.append(cambio)
+
+    return {
+        "base": base,
+        "version": version,
+        "secciones": {k: v for k, v in data.items()
+                      if k != "empresas" and anterior["secciones"].get(k) != _huella(v)},
+        "empresas": empresas,
+    }
+
+
+def publicar_historial(data, version, total_bytes, base=None, anterior=None):
+    """
+    Escribe latest.json (la única URL que cambia de contenido) y el delta
+    contra la versión anterior. El snapshot `historial.<version>.json` se
+    genera en el build (npm run build), no en git.
+    """
+    os.makedirs(PUBLICACION_DIR, exist_ok=True)
+    if version == base:
+        return
+
+    puntero = {
+        "version": version,
+        "archivo": f"/historial/historial.{version}.json",
+        "bytes": total_bytes,
+        "ultima_actualizacion": data.get("ultima_actualizacion"),
+        "delta": None,
+        "delta_base": None,
+    }
+
+    delta = None
+    if anterior is not None:
+        delta = json_compacto(construir_delta(anterior, data, base, version)).encode("utf-8")
+        nombre_delta = f"delta.{base}.{version}.json"
+        _escribir_bytes(os.path.join(PUBLICACION_DIR, nombre_delta), delta)
+        puntero["delta"] = f"/historial/{nombre_delta}"
+        puntero["delta_base"] = base
+
+    # Solo se conserva el delta vigente
+    for ruta in glob.glob(os.path.join(PUBLICACION_DIR, "delta.*")):
+        if f"/historial/{os.path.basename(ruta)}" != puntero["delta"]:
+            os.remove(ruta)
+
+    with open(PUNTERO_PATH, "w", encoding="utf-8") as f:
+        json.dump(puntero, f, ensure_ascii=False, separators=(",", ":"))
+
+    print(f"📦 Publicada versión {version} ({total_bytes / 1024:.1f} KB)"
+          + (f" + delta {len(delta) / 1024:.1f} KB" if delta is not None else ""))
+
+
 # -------------------------------------------------------------------
 # BUSCAR O CREAR LA ENTRADA DE UNA EMPRESA
 # -------------------------------------------------------------------
@@ -821,6 +1560,299 @@ def siguiente_dia_habil(fecha_base):
     return d
 
 
+# -------------------------------------------------------------------
+# SERIES REDUCIDAS PARA LAS GRÁFICAS (LTTB)
+# -------------------------------------------------------------------
+# Ventanas que precalculamos (días naturales; None = toda la historia)
+RESOLUCIONES_SERIES = {"1M": 31, "6M": 183, "all": None}
+PUNTOS_MAX_SERIE = 300
+CAMPOS_SERIES = ("precio_real", "precio_predicho", "error_pct")
+
+
+def lttb(x, y, n):
+    """
+    Largest-Triangle-Three-Buckets: índices de n puntos que conservan la
+    forma de la serie (picos y valles) en lugar de muestrear cada k puntos.
+    """
+    total = len(x)
+    if n >= total or n < 3:
+        return np.arange(total)
+
+    indices = np.empty(n, dtype=int)
+    indices[0], indices[-1] = 0, total - 1
+    cortes = np.linspace(1, total - 1, n - 1).astype(int)
+
+    a = 0
+    for i in range(n - 2):
+        ini, fin = cortes[i], cortes[i + 1]
+        # Promedio del siguiente bucket (o el último punto)
+        sig_ini, sig_fin = fin, cortes[i + 2] if i + 2 < len(cortes) else total
+        cx = x[sig_ini:sig_fin].mean()
+        cy = y[sig_ini:sig_fin].mean()
+        # Punto del bucket actual que forma el triángulo de mayor área
+        areas = np.abs((x[a] - cx) * (y[ini:fin] - y[a]) - (x[a] - x[ini:fin]) * (cy - y[a]))
+        a = ini + int(areas.argmax())
+        indices[i + 1] = a
+    return indices
+
+
+def construir_series(historico, hoy=None, empresa=None):
+    """
+    Por resolución: {"fechas": [...], <campo>: [...]} con ≤ PUNTOS_MAX_SERIE
+    puntos. LTTB elige las fechas sobre el primer campo con datos (precio_real)
+    y los demás campos se toman en esas mismas fechas; null donde no hay dato.
+    Si la empresa ya tiene resúmenes compactados, entran como un punto por
+    periodo (cierre y error medio) antes de las filas diarias.
+    """
+    resumenes = []
+    if empresa is not None:
+        resumenes = empresa.get("resumen_mensual", []) + empresa.get("resumen_semanal", [])
+    historico = [
+        {
+            "fecha": r["hasta"],
+            "precio_real": r["precio_close"],
+            "precio_predicho": None,
+            "error_pct": r["error_medio_pct"],
+        }
+        for r in resumenes
+    ] + list(historico)
+    if not historico:
+        return {}
+    fechas = pd.to_datetime([fila.get("fecha") for fila in historico])
+    dias = np.asarray((fechas - fechas[0]).days, dtype=float)
+    hoy = pd.Timestamp(hoy) if hoy is not None else fechas[-1]
+
+    valores = {
+        campo: np.array(
+            [
+                v if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan
+                for v in (fila.get(campo) for fila in historico)
+            ],
+            dtype=float,
+        )
+        for campo in CAMPOS_SERIES
+    }
+
+    series = {}
+    for nombre, ventana in RESOLUCIONES_SERIES.items():
+        en_rango = np.ones(len(fechas), dtype=bool) if ventana is None \
+            else np.asarray(fechas >= hoy - pd.Timedelta(days=ventana))
+        elegidos = []
+        for y in valores.values():
+            validos = np.flatnonzero(en_rango & np.isfinite(y))
+            if len(validos):
+                elegidos = validos[lttb(dias[validos], y[validos], PUNTOS_MAX_SERIE)]
+                break
+        series[nombre] = {"fechas": [historico[i]["fecha"] for i in elegidos]}
+        for campo, y in valores.items():
+            series[nombre][campo] = [
+                round(float(v), 4) if np.isfinite(v) else None for v in y[elegidos]
+            ]
+    return series
+
+
+def desempeno_empresa(empresa):
+    """
+    Evaluados, aciertos y error medio absoluto de todo el histórico (filas
+    diarias + resúmenes compactados), para no tener que bajarlo en la página.
+    """
+    evaluados = aciertos = 0
+    suma_error = 0.0
+    for r in empresa.get("resumen_mensual", []) + empresa.get("resumen_semanal", []):
+        evaluados += r.get("evaluados") or 0
+        aciertos += r.get("aciertos") or 0
+        suma_error += (r.get("error_medio_pct") or 0) * (r.get("evaluados") or 0)
+    for fila in empresa.get("historico", []):
+        error = fila.get("error_pct")
+        if fila.get("precio_predicho") is None or not isinstance(error, (int, float)) \
+                or not np.isfinite(error):
+            continue
+        evaluados += 1
+        aciertos += bool(fila.get("acierto"))
+        suma_error += abs(error)
+    return {
+        "evaluados": evaluados,
+        "aciertos": aciertos,
+        "error_medio_pct": suma_error / evaluados if evaluados else 0.0,
+        "tasa_aciertos_pct": aciertos / evaluados * 100 if evaluados else 0.0,
+    }
+
+
+def publicar_series(data, version):
+    """
+    SERIES_DIR/index.json: tarjeta de cada empresa sin histórico (estado,
+    predicción, desempeño y las últimas FILAS_RECIENTES filas).
+    SERIES_DIR/<TICKER>.json: series reducidas de esa empresa.
+    """
+    os.makedirs(SERIES_DIR, exist_ok=True)
+    hoy = datetime.fromisoformat(data["ultima_actualizacion"]).date()
+    omitir = ("historico", "resumen_mensual", "resumen_semanal")
+
+    tarjetas, archivos = [], {"index.json"}
+    for empresa in data["empresas"]:
+        tarjeta = {k: v for k, v in empresa.items() if k not in omitir}
+        tarjeta["desempeno"] = desempeno_empresa(empresa)
+        tarjeta["recientes"] = empresa.get("historico", [])[-FILAS_RECIENTES:]
+        tarjetas.append(tarjeta)
+
+        nombre = f"{empresa['ticker']}.json"
+        series = construir_series(empresa.get("historico", []), hoy, empresa)
+        with open(os.path.join(SERIES_DIR, nombre), "w", encoding="utf-8") as f:
+            f.write(json_compacto({"ticker": empresa["ticker"], "series": series}))
+        archivos.add(nombre)
+
+    indice = {
+        "version": version,
+        "ultima_actualizacion": data.get("ultima_actualizacion"),
+        "empresas": tarjetas,
+    }
+    with open(os.path.join(SERIES_DIR, "index.json"), "w", encoding="utf-8") as f:
+        f.write(json_compacto(indice))
+
+    # Tickers que salieron de la lista
+    for ruta in glob.glob(os.path.join(SERIES_DIR, "*.json")):
+        if os.path.basename(ruta) not in archivos:
+            os.remove(ruta)
+
+
+# -------------------------------------------------------------------
+# COMPACTACIÓN: retención diaria + resúmenes semanales/mensuales
+# -------------------------------------------------------------------
+# Filas diarias más viejas que dias_completos pasan a resumen semanal (semana
+# ISO partida en el cambio de mes); los resúmenes semanales más viejos que
+# dias_semanales pasan al mensual de su mes.
+# Con archivar=True las filas crudas se agregan a ARCHIVO_FRIO_DIR.
+COMPACTACION = {
+    "dias_completos": 180,
+    "dias_semanales": 730,
+    "archivar": True,
+}
+ARCHIVO_FRIO_DIR = os.path.join("data", "archivo")
+
+
+def _resumen_de_filas(clave, filas):
+    """Resumen combinable de un grupo de filas diarias"""
+    precios = [f["precio_real"] for f in filas if isinstance(f.get("precio_real"), (int, float))]
+    evaluadas = [f for f in filas if isinstance(f.get("error_pct"), (int, float))
+                 and f.get("precio_predicho") is not None]
+    suma_error = sum(abs(f["error_pct"]) for f in evaluadas)
+    aciertos = sum(1 for f in evaluadas if f.get("acierto"))
+    return {
+        "periodo": clave,
+        "desde": filas[0]["fecha"],
+        "hasta": filas[-1]["fecha"],
+        "filas": len(filas),
+        "evaluados": len(evaluadas),
+        "aciertos": aciertos,
+        "error_medio_pct": suma_error / len(evaluadas) if evaluadas else None,
+        "tasa_aciertos_pct": aciertos / len(evaluadas) * 100 if evaluadas else None,
+        "precio_open": precios[0] if precios else None,
+        "precio_high": max(precios) if precios else None,
+        "precio_low": min(precios) if precios else None,
+        "precio_close": precios[-1] if precios else None,
+    }
+
+
+def _combinar_resumenes(a, b):
+    """Une dos resúmenes consecutivos (a antes que b) del mismo periodo"""
+    evaluados = a["evaluados"] + b["evaluados"]
+    aciertos = a["aciertos"] + b["aciertos"]
+    suma_error = (a["error_medio_pct"] or 0) * a["evaluados"] + (b["error_medio_pct"] or 0) * b["evaluados"]
+    altos = [x for x in (a["precio_high"], b["precio_high"]) if x is not None]
+    bajos = [x for x in (a["precio_low"], b["precio_low"]) if x is not None]
+    return {
+        "periodo": a["periodo"],
+        "desde": a["desde"],
+        "hasta": b["hasta"],
+        "filas": a["filas"] + b["filas"],
+        "evaluados": evaluados,
+        "aciertos": aciertos,
+        "error_medio_pct": suma_error / evaluados if evaluados else None,
+        "tasa_aciertos_pct": aciertos / evaluados * 100 if evaluados else None,
+        "precio_open": a["precio_open"] if a["precio_open"] is not None else b["precio_open"],
+        "precio_high": max(altos) if altos else None,
+        "precio_low": min(bajos) if bajos else None,
+        "precio_close": b["precio_close"] if b["precio_close"] is not None else a["precio_close"],
+    }
+
+
+def _agregar_resumen(lista, resumen):
+    """Agrega al final, combinando si es el mismo periodo (y mes) que el último"""
+    if lista and lista[-1]["periodo"] == resumen["periodo"] \
+            and lista[-1]["desde"][:7] == resumen["desde"][:7]:
+        lista[-1] = _combinar_resumenes(lista[-1], resumen)
+    else:
+        lista.append(resumen)
+
+
+def _archivar_filas(ticker, filas):
+    os.makedirs(ARCHIVO_FRIO_DIR, exist_ok=True)
+    with open(os.path.join(ARCHIVO_FRIO_DIR, f"{ticker}.jsonl"), "a", encoding="utf-8") as f:
+        for fila in filas:
+            f.write(json.dumps(fila, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+def compactar_empresa(empresa, hoy, politica=COMPACTACION):
+    """
+    Incremental: solo toca las filas que envejecieron desde la última corrida
+    (el histórico está en orden, así que salen del principio de la lista).
+    Toda fila sigue el mismo camino diario -> semanal -> mensual, así que
+    compactar día a día deja lo mismo que compactar de una sola vez.
+    Devuelve cuántas filas diarias se compactaron.
+    """
+    historico = empresa.get("historico", [])
+    corte_diario = (hoy - timedelta(days=politica["dias_completos"])).isoformat()
+    corte_semanal = (hoy - timedelta(days=politica["dias_semanales"])).isoformat()
+
+    n = 0
+    while n < len(historico) and historico[n]["fecha"] < corte_diario:
+        n += 1
+    viejas = historico[:n]
+
+    semanal = empresa.setdefault("resumen_semanal", [])
+    mensual = empresa.setdefault("resumen_mensual", [])
+
+    if viejas:
+        if politica.get("archivar"):
+            _archivar_filas(empresa["ticker"], viejas)
+
+        # Filas diarias -> semanas ISO; una semana que cruza de mes queda en
+        # dos piezas para que cada una caiga entera en su mes
+        grupo, clave_grupo = [], None
+        for fila in viejas:
+            anio, semana, _ = datetime.fromisoformat(fila["fecha"]).date().isocalendar()
+            clave = (f"{anio}-W{semana:02d}", fila["fecha"][:7])
+            if clave != clave_grupo and grupo:
+                _agregar_resumen(semanal, _resumen_de_filas(clave_grupo[0], grupo))
+                grupo = []
+            grupo.append(fila)
+            clave_grupo = clave
+        _agregar_resumen(semanal, _resumen_de_filas(clave_grupo[0], grupo))
+
+        del historico[:n]
+
+    # Semanas que ya pasaron el corte -> se funden en su mes
+    m = 0
+    while m < len(semanal) and semanal[m]["hasta"] < corte_semanal:
+        resumen = dict(semanal[m], periodo=semanal[m]["desde"][:7])
+        _agregar_resumen(mensual, resumen)
+        m += 1
+    del semanal[:m]
+
+    empresa["compactado_hasta"] = corte_diario
+    return n
+
+
+def compactar_historial(data, politica=COMPACTACION, hoy=None):
+    hoy = hoy or datetime.now(timezone.utc).date()
+    total = 0
+    for empresa in data["empresas"]:
+        total += compactar_empresa(empresa, hoy, politica)
+    if total:
+        print(f"🗜️ Compactación: {total} filas diarias pasaron a resúmenes")
+    return data
+
+
 # -------------------------------------------------------------------
 # PROCESAR UNA EMPRESA COMPLETA
 # -------------------------------------------------------------------
@@ -835,7 +1867,21 @@ def actualizar_empresa_con_resultados(data, ticker, nombre_mostrar=None):
 
     trading_results = run_trading_system()
 
-    empresa = obtener_o_crear_empresa(data, ticker, nombre_mostrar)
+    return registrar_resultados(data, ticker, trading_results, nombre_mostrar)
+
+
+# -------------------------------------------------------------------
+# VOLCAR LOS RESULTADOS DE UNA EMPRESA AL JSON
+# -------------------------------------------------------------------
+def registrar_resultados(data, ticker, trading_results, nombre_mostrar=None):
+    """
+    Agrega la fila de histórico, la predicción de mañana y el estado actual
+    a partir de un dict de resultados (batch o streaming). Los resultados de un
+    checkpoint traen null donde hubo NaN (p. ej. bb_position con 20 cierres
+    planos). Todo se calcula antes de tocar la empresa: si algo falla, la
+    empresa queda como estaba.
+    """
+    previa = next((e for e in data["empresas"] if e.get("ticker") == ticker), {})
 
     # Momento actual en UTC
     ahora_utc = datetime.now(timezone.utc)
@@ -843,16 +1889,17 @@ def actualizar_empresa_con_resultados(data, ticker, nombre_mostrar=None):
     hoy_str = hoy_utc.isoformat()
 
     # -------- Extracción de valores -------- #
-    current_price = limpiar_valor(trading_results["current_price"])
-    future_prices = [limpiar_valor(p) for p in trading_results["future_prices"]]
+    # Los valores llegan como numpy; se convierten en bloque al armar cada sección
+    current_price = float(trading_results["current_price"])
+    future_prices = np.asarray(trading_results["future_prices"], dtype=float).tolist()
     # future_dates = trading_results["future_dates"]   # ya no confiamos en esta fecha para "mañana"
     signal = trading_results["signal"]
-    signal_strength = limpiar_valor(trading_results["signal_strength"])
+    signal_strength = trading_results["signal_strength"]
     reasoning = trading_results["reasoning"]
     risk = trading_results["risk_management"]
-    model_accuracy = limpiar_valor(trading_results["model_accuracy"])
+    model_accuracy = trading_results["model_accuracy"]
     tech = trading_results["technical_analysis"]
-    avg_error = limpiar_valor(trading_results["avg_error"])
+    avg_error = trading_results["avg_error"]
 
     # -------------------------------------------------------------------
     # 1) HISTÓRICO — comparar valor predicho AYER con valor real HOY
@@ -860,7 +1907,7 @@ def actualizar_empresa_con_resultados(data, ticker, nombre_mostrar=None):
     precio_predicho_hoy = None
 
     # Tomamos la predicción guardada en la corrida anterior (si existía)
-    pred_prev = empresa.get("prediccion_manana")
+    pred_prev = previa.get("prediccion_manana")
     if pred_prev and pred_prev.get("fecha_prediccion") == hoy_str:
         precio_predicho_hoy = limpiar_valor(pred_prev.get("precio_predicho"))
 
@@ -871,20 +1918,19 @@ def actualizar_empresa_con_resultados(data, ticker, nombre_mostrar=None):
         error_pct = None
         acierto = None
 
-    empresa["historico"].append(
-        {
-            "fecha": hoy_str,  # fecha de ejecución (UTC)
-            "precio_real": current_price,
-            "precio_predicho": precio_predicho_hoy,
-            "error_pct": limpiar_valor(error_pct),
-            "acierto": limpiar_valor(acierto),
-        }
-    )
+    fila = a_json_seguro({
+        "fecha": hoy_str,  # fecha de ejecución (UTC)
+        "precio_real": current_price,
+        "precio_predicho": precio_predicho_hoy,
+        "error_pct": error_pct,
+        "acierto": acierto,
+    })
 
     # -------------------------------------------------------------------
     # 2) SOLO GUARDAR LA PREDICCIÓN DE "MAÑANA" (próximo día hábil)
     # -------------------------------------------------------------------
-    if future_prices:
+    prediccion = None
+    if future_prices and np.isfinite(future_prices[0]):
         price = future_prices[0]
 
         # Calculamos la fecha del próximo día hábil a partir de HOY (UTC)
@@ -901,56 +1947,68 @@ def actualizar_empresa_con_resultados(data, ticker, nombre_mostrar=None):
         else:
             tendencia = "estable"
 
-        empresa["prediccion_manana"] = {
+        prediccion = a_json_seguro({
             "fecha_prediccion": fecha_pred_str,
             "precio_predicho": price,
-            "cambio_diario_pct": limpiar_valor(cambio_diario),
-            "cambio_acumulado_pct": limpiar_valor(cambio_acum),
+            "cambio_diario_pct": cambio_diario,
+            "cambio_acumulado_pct": cambio_acum,
             "tendencia": tendencia,
-        }
+        })
 
     # -------------------------------------------------------------------
     # 3) ESTADO ACTUAL COMPLETO (en UTC)
     # -------------------------------------------------------------------
+    # NaN (en memoria) o null (checkpoint) -> None
     rsi = limpiar_valor(tech["rsi"])
     vol_ratio = limpiar_valor(tech["volume_ratio"])
     macd_val = limpiar_valor(tech["macd"])
     bb_pos = limpiar_valor(tech["bb_position"])
 
-    rsi_estado = "Sobrecompra" if rsi > 70 else "Sobreventa" if rsi < 30 else "Neutral"
-    vol_estado = "Alto" if vol_ratio > 1.2 else "Bajo" if vol_ratio < 0.8 else "Normal"
-    macd_estado = "Alcista" if macd_val > 0 else "Bajista"
-    bb_zona = "Soporte" if bb_pos < 0.3 else "Resistencia" if bb_pos > 0.7 else "Neutral"
+    rsi_estado = "N/D" if rsi is None else \
+        "Sobrecompra" if rsi > 70 else "Sobreventa" if rsi < 30 else "Neutral"
+    vol_estado = "N/D" if vol_ratio is None else \
+        "Alto" if vol_ratio > 1.2 else "Bajo" if vol_ratio < 0.8 else "Normal"
+    macd_estado = "N/D" if macd_val is None else "Alcista" if macd_val > 0 else "Bajista"
+    bb_zona = "N/D" if bb_pos is None else \
+        "Soporte" if bb_pos < 0.3 else "Resistencia" if bb_pos > 0.7 else "Neutral"
     senal_icono = signal.split()[0] if signal else ""
 
-    empresa["estado_actual"] = {
+    estado = a_json_seguro({
         "fecha": hoy_str,  # fecha de ejecución (UTC)
         "precio_actual": current_price,
         "rsi": rsi,
         "rsi_estado": rsi_estado,
-        "tendencia_5d_pct": limpiar_valor(tech["trend_5d"]),
-        "tendencia_20d_pct": limpiar_valor(tech["trend_20d"]),
-        "volatilidad_pct": limpiar_valor(tech["volatility"]),
+        "tendencia_5d_pct": tech["trend_5d"],
+        "tendencia_20d_pct": tech["trend_20d"],
+        "volatilidad_pct": tech["volatility"],
+        "cambio_esperado_pct": (future_prices[-1] - current_price) / current_price * 100
+        if future_prices else None,
         "senal": signal,
         "senal_icono": senal_icono,
         "fuerza": signal_strength,
         "razon": reasoning,
+        "modelo_prediccion": trading_results.get("predictor"),
+        "confirmacion_multitemporal": trading_results.get("multitemporal"),
         "precision_backtesting_pct": model_accuracy,
         "error_abs_promedio": avg_error,
-        "stop_loss": limpiar_valor(risk["stop_loss"]) if risk.get("stop_loss") else None,
-        "take_profit": limpiar_valor(risk["take_profit"]) if risk.get("take_profit") else None,
-        "risk_reward": limpiar_valor(risk["risk_reward"])
-        if risk.get("risk_reward") is not None
-        else None,
-        "tamano_posicion": risk["position_size"],
-        "riesgo_por_trade": risk["risk_per_trade"],
+        "stop_loss": risk["stop_loss"] if risk.get("stop_loss") else None,
+        "take_profit": risk["take_profit"] if risk.get("take_profit") else None,
+        "risk_reward": risk["risk_reward"] if risk.get("risk_reward") is not None else None,
+        "tamano_posicion": risk.get("position_size"),
+        "riesgo_por_trade": risk.get("risk_per_trade"),
+        "volumen_ratio": vol_ratio,
         "volumen_estado": vol_estado,
         "macd_valor": macd_val,
         "macd_estado": macd_estado,
-        "bollinger_posicion_pct": limpiar_valor(bb_pos * 100),
+        "bollinger_posicion_pct": bb_pos * 100 if bb_pos is not None else None,
         "bollinger_zona": bb_zona,
-    }
+    })
 
+    empresa = obtener_o_crear_empresa(data, ticker, nombre_mostrar)
+    empresa["historico"].append(fila)
+    if prediccion is not None:
+        empresa["prediccion_manana"] = prediccion
+    empresa["estado_actual"] = estado
     return data
 
 
@@ -972,19 +2030,1714 @@ tickers_a_procesar = {
 
 
 # ========================================================
-#  EJECUCIÓN GENERAL
+#  CORRIDA CON CHECKPOINTS (reanudable con --resume)
 # ========================================================
-if __name__ == "__main__":
+import gc
+import shutil
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Un directorio por corrida (fecha UTC) con un JSON por ticker + manifiesto
+CHECKPOINT_DIR = ".checkpoints"
+
+
+# Tickers por lote del pipeline; al cerrar cada lote se sueltan sus cachés
+PIPELINE_LOTE = 50
+# Presupuesto de RSS: si un lote lo rebasa se vacían las cachés y el lote se parte a la
+# mitad; vuelve a crecer cuando el RSS baja del 75% (0 = sin presupuesto)
+PIPELINE_MEMORIA_MB = 1024
+
+
+def rss_actual_mb():
+    """RSS del proceso en este momento (Linux); si no hay /proc, el pico"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return pico_rss_mb()
+
+
+def pico_rss_mb():
+    """Pico de RSS del proceso según getrusage (None donde no existe resource)"""
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KiB, macOS bytes
+    return pico / 2**20 if sys.platform == "darwin" else pico / 1024
+
+
+def liberar_cache_tickers(tickers=None):
+    """Suelta barras, remuestreos y predicciones de esos tickers (o de todos)"""
+    if tickers is None:
+        _barras_diarias.clear()
+        _cache_remuestreo.clear()
+        _cache_predicciones.clear()
+        return
+    tickers = set(tickers)
+    for tk in tickers:
+        _barras_diarias.pop(tk, None)
+    for clave in [c for c in _cache_remuestreo if c[0] in tickers]:
+        del _cache_remuestreo[clave]
+    # Las claves de predicción pueden llevar sufijo de resolución ("AAPL@W")
+    for clave in [c for c in _cache_predicciones
+                  if c[1] is not None and (c[1] in tickers or str(c[1]).rsplit("@", 1)[0] in tickers)]:
+        del _cache_predicciones[clave]
+
+
+def _etapa(items, nombre, funcion):
+    """
+    Etapa del pipeline: aplica `funcion` a cada ticker que sigue vivo. Un
+    error marca el ticker y lo deja pasar, así la cadena de generadores no se
+    corta por un solo ticker.
+    """
+    for item in items:
+        if item["estado"] is None:
+            try:
+                funcion(item)
+            except Exception as e:
+                item["estado"] = "error"
+                item["error"] = f"{nombre}: {type(e).__name__}: {e}"
+                print(f"❌ {item['ticker']}: {item['error']}")
+        yield item
+
+
+def _descargar(item):
+    global TICKER
+    TICKER = item["ticker"]
+    print("\n" + "=" * 80)
+    print(f"📈 Procesando {item['ticker']} ({item['nombre'] or item['ticker']})")
+    print("=" * 80)
+    item["barras"] = cargar_barras_diarias(item["ticker"])
+
+
+def _indicadores(item):
+    item["df"] = calcular_indicadores(item.pop("barras"))
+    if len(item["df"]) < MIN_FILAS_SENAL:
+        item["estado"] = "omitido"
+        item["motivo"] = f"solo {len(item.pop('df'))} filas con indicadores"
+        print(f"⚠️ {item['ticker']}: omitido ({item['motivo']})")
+
+
+def _etapa_lote(items, nombre, funcion):
+    """
+    Etapa que junta todo el lote y aplica `funcion` a los tickers vivos de una
+    vez. Si falla, los tickers siguen: la etapa siguiente calcula lo que falte
+    ticker por ticker.
+    """
+    items = list(items)
+    vivos = [item for item in items if item["estado"] is None]
+    if vivos:
+        try:
+            funcion(vivos)
+        except Exception as e:
+            print(f"⚠️ {nombre} por lote: {type(e).__name__}: {e}; sigue ticker por ticker")
+    yield from items
+
+
+def _predecir(items):
+    # Deja las predicciones en _cache_predicciones; la etapa de señal las reutiliza
+    predecir_lote({item["ticker"]: item["df"] for item in items}, FORECAST_DAYS)
+
+
+def _senal(item):
+    global TICKER
+    TICKER = item["ticker"]  # el lote ya se descargó completo antes de esta etapa
+    item["resultados"] = get_trading_signal_with_predictions(item.pop("df"))
+
+
+def _serializar(item):
+    _guardar_json_atomico(item["checkpoint"], a_json_seguro(item.pop("resultados")))
+    item["estado"] = "ok"
+
+
+def pipeline_tickers(items):
+    """
+    descarga -> indicadores -> predicción (todo el lote junto) -> señal ->
+    checkpoint; el resto de etapas va un ticker a la vez
+    """
+    items = _etapa(items, "descarga", _descargar)
+    items = _etapa(items, "indicadores", _indicadores)
+    items = _etapa_lote(items, "prediccion", _predecir)
+    items = _etapa(items, "senal", _senal)
+    return _etapa(items, "serializacion", _serializar)
+
+
+def _lotes(secuencia, tamano):
+    """Lotes consecutivos; `tamano` es una lista de un elemento para poder ajustarlo en marcha"""
+    i = 0
+    while i < len(secuencia):
+        lote = secuencia[i:i + tamano[0]]
+        i += len(lote)
+        yield lote
+
+
+def _guardar_json_atomico(ruta, obj):
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        f.write(json_compacto(obj))
+    os.replace(temporal, ruta)
+
+
+def _cargar_manifiesto(ruta, run_id):
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"run_id": run_id, "inicio": datetime.now(timezone.utc).isoformat(), "tickers": {}}
+
+
+def ejecutar_corrida(tickers=tickers_a_procesar, reanudar=False,
+                     lote=PIPELINE_LOTE, memoria_mb=PIPELINE_MEMORIA_MB):
+    """
+    Procesa los tickers por lotes con pipeline_tickers y guarda cada resultado
+    en un checkpoint en cuanto termina; un error en un ticker ya no tumba la
+    corrida. Al final fusiona en historial.json solo los resultados que aún no
+    se habían fusionado. Con reanudar=True se salta los tickers que ya tienen
+    checkpoint. El manifiesto registra el pico de RSS de la corrida.
+    """
+    run_id = datetime.now(timezone.utc).date().isoformat()
+    dir_corrida = os.path.join(CHECKPOINT_DIR, run_id)
+    # Los modelos se entrenan una vez, con el primer lote
+    _modelos_corrida.clear()
+    ruta_manifiesto = os.path.join(dir_corrida, "manifest.json")
+
+    if not reanudar and os.path.isdir(dir_corrida):
+        shutil.rmtree(dir_corrida)
+    os.makedirs(dir_corrida, exist_ok=True)
+
+    manifiesto = _cargar_manifiesto(ruta_manifiesto, run_id)
+    for tk in tickers:
+        manifiesto["tickers"].setdefault(tk, {"estado": "pendiente", "intentos": 0})
+    _guardar_json_atomico(ruta_manifiesto, manifiesto)
+
+    pendientes = []
+    for tk in tickers:
+        entrada = manifiesto["tickers"][tk]
+        if entrada["estado"] == "ok" and os.path.exists(os.path.join(dir_corrida, f"{tk}.json")):
+            print(f"⏭️ {tk}: ya procesado en esta corrida")
+        else:
+            pendientes.append(tk)
+
+    tamano = [max(1, lote)]
+    memoria = {"presupuesto_mb": memoria_mb, "lotes": []}
+    for grupo in _lotes(pendientes, tamano):
+        items = ({"ticker": tk, "nombre": tickers.get(tk), "estado": None,
+                  "checkpoint": os.path.join(dir_corrida, f"{tk}.json"),
+                  "t0": time.perf_counter()} for tk in grupo)
+
+        for item in pipeline_tickers(items):
+            tk = item["ticker"]
+            entrada = {"estado": item["estado"]}
+            for campo in ("motivo", "error"):
+                if campo in item:
+                    entrada[campo] = item[campo]
+            entrada["intentos"] = manifiesto["tickers"][tk].get("intentos", 0) + 1
+            entrada["duracion_s"] = round(time.perf_counter() - item["t0"], 3)
+            manifiesto["tickers"][tk] = entrada
+            _guardar_json_atomico(ruta_manifiesto, manifiesto)
+
+        # Fin del lote: fuera barras, remuestreos y predicciones de estos tickers
+        liberar_cache_tickers(grupo)
+        gc.collect()
+        rss = rss_actual_mb()
+        memoria["lotes"].append({"tickers": len(grupo), "rss_mb": round(rss, 1)})
+        if memoria_mb and rss > memoria_mb:
+            liberar_cache_tickers()
+            gc.collect()
+            tamano[0] = max(1, tamano[0] // 2)
+            print(f"🧠 RSS {rss:.0f} MB > {memoria_mb} MB: lote reducido a {tamano[0]} tickers")
+        elif memoria_mb and rss < 0.75 * memoria_mb and tamano[0] < lote:
+            tamano[0] = min(lote, tamano[0] * 2)
+
+    memoria["tamano_lote_final"] = tamano[0]
+
+    # ---- Fusión: solo lo que no se había escrito en una corrida anterior ----
     data = cargar_historial()
+    fusionados = 0
+    for tk, entrada in manifiesto["tickers"].items():
+        if entrada["estado"] != "ok" or entrada.get("fusionado"):
+            continue
+        try:
+            with open(os.path.join(dir_corrida, f"{tk}.json"), "r", encoding="utf-8") as f:
+                registrar_resultados(data, tk, json.load(f), tickers.get(tk))
+        except Exception as e:
+            # Como en _etapa: el ticker queda en error y la fusión sigue
+            entrada["estado"] = "error"
+            entrada["error"] = f"fusion: {type(e).__name__}: {e}"
+            print(f"❌ {tk}: {entrada['error']}")
+            continue
+        entrada["fusionado"] = True
+        fusionados += 1
+
+    if fusionados:
+        data["screener"] = construir_screener(data["empresas"])
+        if data["screener"]:
+            print("\n🏆 SCREENER - mejores:", ", ".join(f["ticker"] for f in data["screener"]["top"][:5]))
+            print("   peores:", ", ".join(f["ticker"] for f in data["screener"]["bottom"][:5]))
+        rendimientos = panel_rendimientos(tickers)
+        actualizar_riesgo_cartera(data, tickers, rendimientos=rendimientos)
+        actualizar_var_es(data, rendimientos)
+        compactar_historial(data)
+        guardar_historial(data)
+
+    memoria["pico_rss_mb"] = round(pico_rss_mb(), 1) if resource is not None else None
+    manifiesto["memoria"] = memoria
+    manifiesto["fin"] = datetime.now(timezone.utc).isoformat()
+    _guardar_json_atomico(ruta_manifiesto, manifiesto)
+
+    # Checkpoints de días anteriores ya no sirven
+    for viejo in glob.glob(os.path.join(CHECKPOINT_DIR, "*")):
+        if os.path.basename(viejo) != run_id:
+            shutil.rmtree(viejo, ignore_errors=True)
+
+    conteo = {}
+    for entrada in manifiesto["tickers"].values():
+        conteo[entrada["estado"]] = conteo.get(entrada["estado"], 0) + 1
+    print(f"\n📋 Corrida {run_id}: " + ", ".join(f"{k}={v}" for k, v in sorted(conteo.items())))
+    if memoria["pico_rss_mb"] is not None:
+        print(f"🧠 Pico de RSS: {memoria['pico_rss_mb']:.0f} MB (presupuesto {memoria_mb} MB, "
+              f"{len(memoria['lotes'])} lotes)")
+    return manifiesto
 
-    for tk, nombre in tickers_a_procesar.items():
-        data = actualizar_empresa_con_resultados(data, tk, nombre)
 
-    # Timestamp UTC con zona
-    data["ultima_actualizacion"] = datetime.now(timezone.utc).isoformat()
+# ========================================================
+#  SCREENER TRANSVERSAL (ranking de todo el universo)
+# ========================================================
+# Cuántas empresas mostrar arriba y abajo del ranking
+SCREENER_TOP_N = 10
+
+# Campos de estado_actual que entran al score y su peso sobre el z-score.
+# RSI y volatilidad restan: sobrecompra y ruido castigan la posición.
+SCREENER_PESOS = {
+    "fuerza": 1.0,
+    "cambio_esperado_pct": 1.0,
+    "rsi": -0.5,
+    "volatilidad_pct": -0.5,
+    "volumen_ratio": 0.5,
+}
 
-    os.makedirs(os.path.dirname(JSON_PATH), exist_ok=True)
-    with open(JSON_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
 
-    print("\n📁 historial.json actualizado con TODAS las empresas (UTC)")
+def _seleccionar(score, k, mayores=True):
+    """Índices de los k mejores (o peores) sin ordenar todo el arreglo"""
+    if k <= 0:
+        return np.array([], dtype=int)
+    orden = -score if mayores else score
+    if k < len(score):
+        idx = np.argpartition(orden, k - 1)[:k]
+    else:
+        idx = np.arange(len(score))
+    return idx[np.argsort(orden[idx], kind="stable")]
+
+
+def estados_vigentes(empresas, fecha=None):
+    """
+    [(ticker, estado_actual)] de las empresas evaluadas en `fecha` (hoy UTC
+    por defecto) y cuántas se dejaron fuera por tener un estado viejo: un
+    ticker que falló hoy o que salió de la lista conserva el de su última corrida.
+    """
+    fecha = fecha or datetime.now(timezone.utc).date().isoformat()
+    filas, viejas = [], 0
+    for e in empresas:
+        ea = e.get("estado_actual")
+        if not ea:
+            continue
+        if ea.get("fecha") == fecha:
+            filas.append((e["ticker"], ea))
+        else:
+            viejas += 1
+    return filas, viejas
+
+
+def construir_screener(empresas, top_n=SCREENER_TOP_N, pesos=SCREENER_PESOS, fecha=None):
+    """
+    Z-scores transversales, score ponderado y ranking de las empresas
+    evaluadas en `fecha` (ver estados_vigentes). Todo se hace sobre arreglos
+    (empresas × métricas); los valores faltantes cuentan como z = 0 (neutral).
+    """
+    fecha = fecha or datetime.now(timezone.utc).date().isoformat()
+    filas, excluidas = estados_vigentes(empresas, fecha)
+    if excluidas:
+        print(f"⚠️ Screener: {excluidas} empresas fuera por no tener estado del {fecha}")
+    if not filas:
+        return None
+
+    metricas = list(pesos)
+    tickers = [tk for tk, _ in filas]
+    X = np.array(
+        [
+            [
+                v if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan
+                for v in (estado.get(m) for m in metricas)
+            ]
+            for _, estado in filas
+        ],
+        dtype=float,
+    )
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        media = np.nanmean(X, axis=0)
+        desv = np.nanstd(X, axis=0)
+    desv = np.where(np.isfinite(desv) & (desv > 0), desv, 1.0)
+    Z = np.nan_to_num((X - media) / desv)
+
+    score = Z @ np.array([pesos[m] for m in metricas])
+
+    # Rango 1 = mejor score
+    rango = np.empty(len(score), dtype=int)
+    rango[np.argsort(-score, kind="stable")] = np.arange(1, len(score) + 1)
+
+    def tarjeta(i):
+        fila = {"ticker": tickers[i], "score": round(float(score[i]), 3), "rango": int(rango[i])}
+        for j, m in enumerate(metricas):
+            fila[m] = None if np.isnan(X[i, j]) else round(float(X[i, j]), 3)
+        return fila
+
+    k = min(top_n, len(score))
+    return {
+        "fecha": fecha,
+        "total": len(tickers),
+        "excluidas": excluidas,
+        "pesos": pesos,
+        "top": [tarjeta(i) for i in _seleccionar(score, k, mayores=True)],
+        "bottom": [tarjeta(i) for i in _seleccionar(score, k, mayores=False)],
+        # Columnas compactas para ordenar/filtrar en el front sin tarjetas
+        "tickers": tickers,
+        "score": np.round(score, 3).tolist(),
+        "rango": rango.tolist(),
+        "z": {m: np.round(Z[:, j], 3).tolist() for j, m in enumerate(metricas)},
+    }
+
+
+# ========================================================
+#  BACKTEST VECTORIZADO (stop loss / take profit)
+# ========================================================
+import heapq
+
+BACKTEST_CAPITAL = 100_000
+BACKTEST_RIESGO = 0.02              # "2% del capital" por operación
+BACKTEST_EXPOSICION_MAX = 1.0       # nocional abierto / equity (sin apalancamiento)
+BACKTEST_MAX_POSICIONES = 5         # operaciones abiertas a la vez
+BACKTEST_STOP_PCT = 0.03            # mismo ±3% de calculate_risk_management
+BACKTEST_HORIZONTE = FORECAST_DAYS  # barras máximas por operación
+# position_size de calculate_risk_management -> fracción del riesgo asignado
+BACKTEST_TAMANOS = {"Alta": 1.0, "Moderada": 0.5, "Leve": 0.25}
+
+
+def descargar_panel(tickers):
+    """Una sola descarga para todo el universo -> {ticker: DataFrame con indicadores}"""
+    print(f"📥 Descargando panel de {len(tickers)} empresas...")
+    raw = yf.download(list(tickers), start=START_DATE, end=END_DATE,
+                      progress=False, group_by="ticker")
+    frames = {}
+    for tk in tickers:
+        try:
+            df = raw[tk].dropna(how="all")
+        except KeyError:
+            print(f"⚠️ {tk}: sin datos en la descarga")
+            continue
+        df = calcular_indicadores(df)
+        if len(df) > 30:
+            frames[tk] = df
+    return frames
+
+
+def armar_panel(frames, columnas):
+    """Alinea los DataFrames por fecha -> (fechas, tickers, {columna: matriz T × N})"""
+    tickers = list(frames)
+    panel = {}
+    for col in columnas:
+        tabla = pd.concat({tk: frames[tk][col] for tk in tickers}, axis=1).sort_index()
+        panel[col] = tabla.to_numpy(dtype=float)
+    return tabla.index, tickers, panel
+
+
+def prediccion_vectorizada(close, days=FORECAST_DAYS, modelo=None):
+    """
+    Precio objetivo del predictor (último día) para cada fecha y ticker a la
+    vez. close es una matriz T × N; filas sin historia -> NaN. Las ventanas
+    se arman por bloques de fechas para no copiar T × N × ventana de golpe.
+    """
+    modelo = modelo or preparar_predictor(close, days)
+    T, N = close.shape
+    objetivo = np.full_like(close, np.nan)
+    if T < PREDICTOR_VENTANA:
+        return objetivo
+
+    ventanas = np.lib.stride_tricks.sliding_window_view(close, PREDICTOR_VENTANA, axis=0)
+    bloque = max(1, 2_000_000 // (N * PREDICTOR_VENTANA))
+    for inicio in range(0, len(ventanas), bloque):
+        X = ventanas[inicio:inicio + bloque].reshape(-1, PREDICTOR_VENTANA)
+        ok = ~np.isnan(X).any(axis=1)
+        pred = np.full(len(X), np.nan)
+        if ok.any():
+            pred[ok] = modelo.predict(X[ok], days)[:, -1]
+        fila = PREDICTOR_VENTANA - 1 + inicio
+        objetivo[fila:fila + len(pred) // N] = pred.reshape(-1, N)
+    return objetivo
+
+
+def evaluar_senal_vectorizada(rsi, price_change, volume_ratio, macd, macd_signal_val,
+                              macd_histogram, trend_5d, trend_20d, bb_position):
+    """evaluar_senal sobre arreglos: devuelve la fuerza total (NaN si falta algún dato)"""
+    rsi_signal = np.select([rsi < 30, rsi < 45, rsi > 70, rsi > 55], [2, 1, -2, -1], 0)
+    price_signal = np.select(
+        [price_change > 5, price_change > 2, price_change > 0.5,
+         price_change < -5, price_change < -2, price_change < -0.5],
+        [3, 2, 1, -3, -2, -1], 0)
+    volume_signal = np.select(
+        [volume_ratio > 1.5, volume_ratio > 1.2, volume_ratio < 0.7, volume_ratio < 0.9],
+        [2, 1, -1, -0.5], 0)
+    macd_signal = np.select(
+        [(macd > macd_signal_val) & (macd_histogram > 0), macd > macd_signal_val,
+         (macd < macd_signal_val) & (macd_histogram < 0), macd < macd_signal_val],
+        [2, 1, -2, -1], 0)
+    trend_signal = np.select(
+        [(trend_5d > 2) & (trend_20d > 1), (trend_5d > 0) & (trend_20d > 0),
+         (trend_5d < -2) & (trend_20d < -1), (trend_5d < 0) & (trend_20d < 0)],
+        [2, 1, -2, -1], 0)
+    bb_signal = np.select([bb_position < 0.2, bb_position > 0.8], [1, -1], 0)
+
+    total = (rsi_signal + price_signal + volume_signal +
+             macd_signal + trend_signal + bb_signal).astype(float)
+
+    faltantes = np.zeros(total.shape, dtype=bool)
+    for arr in (rsi, price_change, volume_ratio, macd, macd_signal_val,
+                macd_histogram, trend_5d, trend_20d, bb_position):
+        faltantes |= np.isnan(arr)
+    total[faltantes] = np.nan
+    return total
+
+
+def nivel_senal(total):
+    """Fuerza total -> nivel -3..3 (VENDER FUERTE .. COMPRAR FUERTE), mismos cortes"""
+    return np.select(
+        [total >= 6, total >= 4, total >= 2, total <= -6, total <= -4, total <= -2],
+        [3, 2, 1, -3, -2, -1], 0)
+
+
+def senales_historicas(panel, days=FORECAST_DAYS, modelo=None):
+    """Serie de señales y precios objetivo para todo el panel -> (nivel, objetivo)"""
+    close = panel['Close']
+    objetivo = prediccion_vectorizada(close, days, modelo)
+
+    def atras(n):
+        previo = np.full_like(close, np.nan)
+        previo[n:] = close[:-n]
+        return previo
+
+    total = evaluar_senal_vectorizada(
+        rsi=panel['RSI_14'],
+        price_change=(objetivo - close) / close * 100,
+        volume_ratio=panel['Volume_Ratio'],
+        macd=panel['MACD'],
+        macd_signal_val=panel['MACD_signal'],
+        macd_histogram=panel['MACD_histogram'],
+        trend_5d=(close - atras(4)) / atras(4) * 100,
+        trend_20d=(close - atras(19)) / atras(19) * 100,
+        bb_position=(close - panel['BB_lower']) / (panel['BB_upper'] - panel['BB_lower']),
+    )
+    nivel = np.where(np.isnan(total), 0, nivel_senal(np.nan_to_num(total)))
+    return nivel, objetivo
+
+
+def ejecutar_backtest(frames, capital=BACKTEST_CAPITAL, riesgo=BACKTEST_RIESGO,
+                      stop_pct=BACKTEST_STOP_PCT, horizonte=BACKTEST_HORIZONTE,
+                      exposicion_max=BACKTEST_EXPOSICION_MAX,
+                      max_posiciones=BACKTEST_MAX_POSICIONES):
+    """
+    Reproduce señales + reglas de salida sobre todo el panel OHLC.
+
+    Se abre una operación cuando cambia la dirección de la señal (entrada al
+    cierre). La salida es el primer toque de stop o take profit dentro de
+    `horizonte` barras, buscado a la vez para todas las operaciones sobre una
+    matriz operaciones × horizonte; si nada se toca se sale al cierre de la
+    última barra. Si el mismo día tocan ambos, se asume el stop (conservador).
+
+    El tamaño sí depende del orden: cada operación arriesga `riesgo` del
+    equity realizado al entrar, el nocional abierto no pasa de
+    `exposicion_max` × equity ni hay más de `max_posiciones` abiertas, y sin
+    equity no se abre nada más.
+    """
+    columnas = ['Open', 'High', 'Low', 'Close', 'RSI_14', 'Volume_Ratio', 'MACD',
+                'MACD_signal', 'MACD_histogram', 'BB_upper', 'BB_lower']
+    fechas, tickers, panel = armar_panel(frames, columnas)
+    T = len(fechas)
+
+    # Los modelos que se entrenan solo ven la primera mitad (sin mirar al futuro)
+    corte = T // 2
+    modelo = preparar_predictor(panel['Close'][:corte], FORECAST_DAYS)
+
+    nivel, objetivo = senales_historicas(panel, modelo=modelo)
+    direccion = np.sign(nivel)
+
+    # Entradas: la señal pasa a compra/venta o cambia de lado
+    previa = np.vstack([np.zeros((1, direccion.shape[1])), direccion[:-1]])
+    ti, tj = np.nonzero((direccion != 0) & (direccion != previa))
+
+    d = direccion[ti, tj]
+    entrada = panel['Close'][ti, tj]
+    stop = entrada * (1 - stop_pct * d)
+    take_profit = objetivo[ti, tj]
+    # Un objetivo del lado equivocado no se puede "tomar": solo queda el stop
+    take_profit = np.where((take_profit - entrada) * d > 0, take_profit, np.nan)
+    factor = np.where(np.abs(nivel[ti, tj]) == 3,
+                      BACKTEST_TAMANOS["Alta"], BACKTEST_TAMANOS["Moderada"])
+
+    # Ventanas operaciones × horizonte con las barras posteriores a la entrada
+    filas = ti[:, None] + np.arange(1, horizonte + 1)
+    fuera = filas >= T
+    filas = np.minimum(filas, T - 1)
+    col = tj[:, None]
+    ventana = {}
+    for c in ('Open', 'High', 'Low', 'Close'):
+        ventana[c] = np.where(fuera, np.nan, panel[c][filas, col])
+
+    dd, st, tp = d[:, None], stop[:, None], take_profit[:, None]
+    toca_stop = np.where(dd > 0, ventana['Low'] <= st, ventana['High'] >= st)
+    toca_tp = np.where(dd > 0, ventana['High'] >= tp, ventana['Low'] <= tp)
+    toca = toca_stop | toca_tp
+
+    hay_toque = toca.any(axis=1)
+    primer = toca.argmax(axis=1)
+    idx_validos = np.where(~np.isnan(ventana['Close']), np.arange(horizonte), -1)
+    ultimo = idx_validos.max(axis=1)
+
+    k = np.where(hay_toque, primer, ultimo)
+    r = np.arange(len(ti))
+    apertura = ventana['Open'][r, k]
+    por_stop = hay_toque & toca_stop[r, k]
+    por_tp = hay_toque & ~por_stop
+
+    # Si la apertura ya brincó el nivel, se ejecuta a la apertura
+    salida_stop = np.where(d > 0, np.fmin(apertura, stop), np.fmax(apertura, stop))
+    salida_tp = np.where(d > 0, np.fmax(apertura, take_profit), np.fmin(apertura, take_profit))
+    salida = np.select([por_stop, por_tp], [salida_stop, salida_tp], ventana['Close'][r, k])
+
+    # Operaciones sin ninguna barra posterior (al final de la historia) se descartan
+    ok = (ultimo >= 0) & ~np.isnan(salida) & ~np.isnan(entrada)
+    fila_salida = filas[r, k][ok]
+    rendimiento = d[ok] * (salida[ok] / entrada[ok] - 1)
+    factor, ti, tj = factor[ok], ti[ok], tj[ok]
+    por_stop, por_tp = por_stop[ok], por_tp[ok]
+
+    # Tamaño: el stop arriesga `riesgo` del equity realizado (escalado por
+    # position_size), recortado al margen de exposición que queda
+    nocional = np.zeros(len(ti))
+    equity_real = capital
+    abiertas = []  # heap (fila_salida, operación)
+    expuesto = 0.0
+    for o in range(len(ti)):  # ti viene ordenado (np.nonzero por filas)
+        while abiertas and abiertas[0][0] <= ti[o]:
+            _, c = heapq.heappop(abiertas)
+            equity_real += nocional[c] * rendimiento[c]
+            expuesto -= nocional[c]
+        if equity_real <= 0:
+            break
+        if len(abiertas) >= max_posiciones:
+            continue
+        margen = exposicion_max * equity_real - expuesto
+        tamano = min(equity_real * riesgo * factor[o] / stop_pct, margen)
+        if tamano <= 0:
+            continue
+        nocional[o] = tamano
+        expuesto += tamano
+        heapq.heappush(abiertas, (fila_salida[o], o))
+
+    tomada = nocional > 0
+    pnl = (nocional * rendimiento)[tomada]
+    fila_salida, tj = fila_salida[tomada], tj[tomada]
+    por_stop, por_tp = por_stop[tomada], por_tp[tomada]
+
+    equity = capital + np.cumsum(np.bincount(fila_salida, weights=pnl, minlength=T))
+    drawdown = equity / np.maximum.accumulate(equity) - 1
+
+    n_ops = len(pnl)
+    por_ticker = {}
+    if n_ops:
+        ops_t = np.bincount(tj, minlength=len(tickers))
+        gan_t = np.bincount(tj, weights=(pnl > 0), minlength=len(tickers))
+        pnl_t = np.bincount(tj, weights=pnl, minlength=len(tickers))
+        for j, tk in enumerate(tickers):
+            if ops_t[j]:
+                por_ticker[tk] = {
+                    "operaciones": int(ops_t[j]),
+                    "tasa_aciertos_pct": round(float(gan_t[j] / ops_t[j] * 100), 2),
+                    "pnl": round(float(pnl_t[j]), 2),
+                }
+
+    return {
+        "fecha": datetime.now(timezone.utc).date().isoformat(),
+        "desde": fechas[0].date().isoformat() if T else None,
+        "hasta": fechas[-1].date().isoformat() if T else None,
+        "predictor": PREDICTOR,
+        "entrenamiento_hasta": fechas[corte].date().isoformat()
+        if modelo.requiere_entrenamiento and T else None,
+        "capital_inicial": capital,
+        "capital_final": round(float(equity[-1]), 2) if T else capital,
+        "retorno_total_pct": round(float((equity[-1] / capital - 1) * 100), 2) if T else 0.0,
+        "max_drawdown_pct": round(float(drawdown.min() * 100), 2) if T else 0.0,
+        "operaciones": n_ops,
+        "senales_sin_operar": int((~tomada).sum()),
+        "tasa_aciertos_pct": round(float((pnl > 0).mean() * 100), 2) if n_ops else None,
+        "salidas": {
+            "stop_loss": int(por_stop.sum()),
+            "take_profit": int(por_tp.sum()),
+            "horizonte": int(n_ops - por_stop.sum() - por_tp.sum()),
+        },
+        "por_ticker": por_ticker,
+        "curva": {
+            "fechas": [f.date().isoformat() for f in fechas],
+            "equity": np.round(equity, 2).tolist(),
+            "drawdown_pct": np.round(drawdown * 100, 2).tolist(),
+        },
+    }
+
+
+# ========================================================
+#  RIESGO DE CARTERA (covarianza EW incremental)
+# ========================================================
+# RiskMetrics: lambda 0.94 (vida media ~11 días)
+COVARIANZA_LAMBDA = 0.94
+# Peso del objetivo diagonal al encoger las covarianzas (0 = sin encogimiento)
+COVARIANZA_ENCOGIMIENTO = 0.1
+# Peso acumulado mínimo (1 - lambda^n) para confiar en la varianza de un ticker
+COVARIANZA_PESO_MIN = 0.5
+# Días de historia con que se siembra la matriz la primera vez
+COVARIANZA_SEMILLA = 250
+COVARIANZA_PATH = "data/estado/covarianza.npz"
+RIESGO_PARES_TOP = 10
+
+
+class CovarianzaEW:
+    """
+    Covarianza exponencial de los rendimientos diarios del universo.
+
+    Cada día nuevo es una actualización de rango 1, S <- lambda*S + (1-lambda)*r r',
+    sin volver a recorrer la historia. Los faltantes entran como 0 y la matriz
+    `peso` (misma recursión sobre la máscara de observados) corrige el sesgo de
+    cada par, así que un ticker nuevo o con huecos no queda subestimado.
+    """
+
+    def __init__(self, tickers=(), lam=COVARIANZA_LAMBDA):
+        self.lam = lam
+        self.tickers = []
+        self.indice = {}
+        self.suma = np.zeros((0, 0))
+        self.peso = np.zeros((0, 0))
+        self.fecha = None
+        self.asegurar_tickers(tickers)
+
+    def asegurar_tickers(self, tickers):
+        """Agrega filas/columnas en cero para los tickers que aún no están"""
+        nuevos = [tk for tk in tickers if tk not in self.indice]
+        if not nuevos:
+            return
+        n, k = len(self.tickers), len(nuevos)
+        for nombre in ("suma", "peso"):
+            ampliada = np.zeros((n + k, n + k))
+            ampliada[:n, :n] = getattr(self, nombre)
+            setattr(self, nombre, ampliada)
+        for tk in nuevos:
+            self.indice[tk] = len(self.tickers)
+            self.tickers.append(tk)
+
+    def actualizar(self, fecha, r):
+        """Rango 1 con los rendimientos de un día (NaN = sin dato), en el orden de self.tickers"""
+        observado = ~np.isnan(r)
+        r = np.where(observado, r, 0.0)
+        m = observado.astype(float)
+        self.suma *= self.lam
+        self.suma += np.outer((1 - self.lam) * r, r)
+        self.peso *= self.lam
+        self.peso += np.outer((1 - self.lam) * m, m)
+        self.fecha = fecha
+
+    def sembrar(self, fechas, R):
+        """Equivale a len(fechas) llamadas a actualizar(), pero en dos productos matriciales"""
+        T = len(R)
+        w = (1 - self.lam) * self.lam ** np.arange(T - 1, -1, -1)
+        observado = ~np.isnan(R)
+        R = np.where(observado, R, 0.0)
+        M = observado.astype(float)
+        self.suma = self.suma * self.lam ** T + (R * w[:, None]).T @ R
+        self.peso = self.peso * self.lam ** T + (M * w[:, None]).T @ M
+        self.fecha = fechas[-1]
+
+    def incorporar(self, rendimientos):
+        """Aplica los días de `rendimientos` (fechas × tickers) posteriores a self.fecha"""
+        self.asegurar_tickers(rendimientos.columns)
+        tabla = rendimientos.reindex(columns=self.tickers)
+        if self.fecha is None:
+            tabla = tabla.tail(COVARIANZA_SEMILLA)
+            if len(tabla):
+                self.sembrar(tabla.index, tabla.to_numpy(dtype=float))
+            return len(tabla)
+
+        tabla = tabla[tabla.index > self.fecha]
+        for fecha, fila in zip(tabla.index, tabla.to_numpy(dtype=float)):
+            self.actualizar(fecha, fila)
+        return len(tabla)
+
+    def validos(self):
+        return np.diag(self.peso) >= COVARIANZA_PESO_MIN
+
+    def covarianza(self, encogimiento=COVARIANZA_ENCOGIMIENTO):
+        """
+        Covarianza corregida por sesgo; con encogimiento las covarianzas se
+        acercan al objetivo diagonal (mismas varianzas, correlación 0).
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cov = np.where(self.peso > 0, self.suma / self.peso, 0.0)
+        if encogimiento:
+            varianzas = np.diag(cov).copy()
+            cov *= 1 - encogimiento
+            np.fill_diagonal(cov, varianzas)
+        return cov
+
+    def correlacion(self, encogimiento=COVARIANZA_ENCOGIMIENTO, cov=None):
+        if cov is None:
+            cov = self.covarianza(encogimiento)
+        d = np.sqrt(np.diag(cov))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corr = cov / np.outer(d, d)
+        return np.nan_to_num(corr)
+
+    def guardar(self, ruta=COVARIANZA_PATH):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = ruta + ".tmp.npz"
+        np.savez(temporal, tickers=np.array(self.tickers, dtype=str), suma=self.suma,
+                 peso=self.peso, lam=self.lam,
+                 fecha=str(self.fecha.date()) if self.fecha is not None else "")
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, ruta=COVARIANZA_PATH, lam=COVARIANZA_LAMBDA):
+        """Estado de la corrida anterior; si no existe o cambió lambda se empieza de cero"""
+        try:
+            with np.load(ruta, allow_pickle=False) as f:
+                if float(f["lam"]) != lam:
+                    return cls(lam=lam)
+                estado = cls(f["tickers"].tolist(), lam)
+                estado.suma = f["suma"]
+                estado.peso = f["peso"]
+                fecha = str(f["fecha"])
+        except (OSError, KeyError, ValueError):
+            return cls(lam=lam)
+        estado.fecha = pd.Timestamp(fecha) if fecha else None
+        return estado
+
+
+def panel_rendimientos(tickers):
+    """Rendimientos diarios fechas × tickers a partir de la caché de barras (sin red)"""
+    cierres = {}
+    for tk in tickers:
+        barras = _barras_diarias.get(tk)
+        if barras is None:
+            barras = _leer_barras_disco(tk)
+        if barras is not None and len(barras):
+            cierres[tk] = barras['Close']
+    if not cierres:
+        return pd.DataFrame()
+    tabla = pd.concat(cierres, axis=1).sort_index()
+    return (tabla / tabla.shift(1) - 1).iloc[1:]
+
+
+def pesos_senales(empresas, fecha=None):
+    """
+    {ticker: ±BACKTEST_TAMANOS[tamano_posicion]} de las empresas con señal de
+    compra/venta de `fecha` (mismo filtro que el screener: sin señales viejas)
+    """
+    pesos = {}
+    for ticker, ea in estados_vigentes(empresas, fecha)[0]:
+        senal = ea.get("senal") or ""
+        lado = 1 if "COMPRAR" in senal else -1 if "VENDER" in senal else 0
+        peso = lado * BACKTEST_TAMANOS.get(ea.get("tamano_posicion"), 0)
+        if peso:
+            pesos[ticker] = peso
+    return pesos
+
+
+def riesgo_cartera(estado, empresas, encogimiento=COVARIANZA_ENCOGIMIENTO):
+    """
+    Riesgo de la cartera que implican las señales actuales: cada empresa pesa
+    ±BACKTEST_TAMANOS[tamano_posicion] (signo por COMPRAR/VENDER) y los pesos
+    se normalizan a exposición bruta 1.
+    """
+    validos = estado.validos()
+    cov = estado.covarianza(encogimiento)
+    corr = estado.correlacion(cov=cov)
+    tickers = estado.tickers
+
+    activos, pesos = [], []
+    for tk, peso in pesos_senales(empresas).items():
+        i = estado.indice.get(tk)
+        if i is not None and validos[i]:
+            activos.append(i)
+            pesos.append(peso)
+
+    # Pares más correlacionados de todo el universo (triángulo superior)
+    ok = np.flatnonzero(validos)
+    filas, cols = np.triu_indices(len(ok), 1)
+    valores = corr[ok[filas], ok[cols]]
+    pares = [{"a": tickers[ok[filas[k]]], "b": tickers[ok[cols[k]]], "correlacion": valores[k]}
+             for k in _seleccionar(valores, RIESGO_PARES_TOP)]
+
+    resultado = {
+        "fecha": str(estado.fecha.date()) if estado.fecha is not None else None,
+        "lambda": estado.lam,
+        "encogimiento": encogimiento,
+        "tickers_validos": int(validos.sum()),
+        "posiciones_activas": len(activos),
+        "estados_viejos_excluidos": estados_vigentes(empresas)[1],
+        "pares_mas_correlacionados": pares,
+    }
+    if not activos:
+        return a_json_seguro(resultado)
+
+    idx = np.array(activos)
+    w = np.array(pesos) / np.abs(pesos).sum()
+    sub = cov[np.ix_(idx, idx)]
+    sigma = np.sqrt(np.diag(sub))
+    marginal = sub @ w
+    varianza = w @ marginal
+    vol_cartera = np.sqrt(varianza)
+    vol_aislada = np.abs(w) @ sigma
+
+    # Correlación más alta de cada posición con cualquier otro ticker válido
+    cruzada = corr[idx][:, ok].copy()
+    cruzada[ok[None, :] == idx[:, None]] = -np.inf
+    mas_cercano = ok[np.argmax(cruzada, axis=1)]
+
+    sub_corr = corr[np.ix_(idx, idx)]
+    resultado.update({
+        "volatilidad_diaria_pct": vol_cartera * 100,
+        "volatilidad_aislada_pct": vol_aislada * 100,
+        "ratio_diversificacion": vol_aislada / vol_cartera if vol_cartera > 0 else None,
+        "correlacion_media_activas": sub_corr[np.triu_indices(len(idx), 1)].mean()
+        if len(idx) > 1 else None,
+        "posiciones": [
+            {
+                "ticker": tickers[i],
+                "peso": w[k],
+                "volatilidad_diaria_pct": sigma[k] * 100,
+                "contribucion_riesgo_pct": w[k] * marginal[k] / varianza * 100 if varianza > 0 else None,
+                "correlacion_max": {"ticker": tickers[mas_cercano[k]], "valor": corr[i, mas_cercano[k]]}
+                if len(ok) > 1 else None,
+            }
+            for k, i in enumerate(idx)
+        ],
+    })
+    return a_json_seguro(resultado)
+
+
+def actualizar_riesgo_cartera(data, tickers, ruta=COVARIANZA_PATH, rendimientos=None):
+    """Carga el estado, incorpora los días nuevos, lo guarda y deja data["riesgo_cartera"]"""
+    if rendimientos is None:
+        rendimientos = panel_rendimientos(tickers)
+    estado = CovarianzaEW.cargar(ruta)
+    dias = estado.incorporar(rendimientos)
+    if dias:
+        estado.guardar(ruta)
+    data["riesgo_cartera"] = riesgo_cartera(estado, data["empresas"])
+
+    r = data["riesgo_cartera"]
+    if r.get("volatilidad_diaria_pct") is not None:
+        print(f"\n🧮 RIESGO DE CARTERA: vol diaria {r['volatilidad_diaria_pct']:.2f}% "
+              f"(aislada {r['volatilidad_aislada_pct']:.2f}%, {r['posiciones_activas']} posiciones, "
+              f"{dias} días nuevos en la covarianza)")
+    return data["riesgo_cartera"]
+
+
+# ========================================================
+#  VaR / ES (histórico y paramétrico, todo el universo a la vez)
+# ========================================================
+from statistics import NormalDist
+
+VAR_NIVELES = (0.95, 0.99)
+VAR_HORIZONTES = (1, 5)         # días hábiles
+VAR_VENTANA = 250               # rendimientos diarios por ventana (~1 año)
+VAR_MIN_OBS = 60                # con menos observaciones el ticker queda en None
+
+
+def rendimientos_horizonte(R, h):
+    """Rendimientos compuestos a h días en ventanas solapadas (NaN si falta algún día)"""
+    if h == 1:
+        return R
+    faltante = np.isnan(R)
+    log_acum = np.vstack([np.zeros((1, R.shape[1])),
+                          np.cumsum(np.log1p(np.where(faltante, 0.0, R)), axis=0)])
+    obs_acum = np.vstack([np.zeros((1, R.shape[1]), dtype=int),
+                          np.cumsum(~faltante, axis=0)])
+    completos = (obs_acum[h:] - obs_acum[:-h]) == h
+    return np.where(completos, np.expm1(log_acum[h:] - log_acum[:-h]), np.nan)
+
+
+def var_es_historico(X, niveles=VAR_NIVELES):
+    """
+    VaR/ES históricos de cada columna de X (ventana × tickers). Un solo
+    np.partition aparta los k peores rendimientos de todas las columnas y
+    solo esa cola se ordena; cada columna usa su propio k según sus datos.
+    Devuelve {nivel: (var, es)} como pérdidas positivas.
+    """
+    n = (~np.isnan(X)).sum(axis=0)
+    # Redondeo antes del techo: (1 - 0.95) * 200 da 10.000000000000002 y no 10
+    colas = {nivel: np.maximum(1, np.ceil(np.round((1 - nivel) * n, 9)).astype(int))
+             for nivel in niveles}
+    k = min(len(X), max(int(m.max()) for m in colas.values()))
+
+    # Los NaN van al final como +inf; nunca entran en la cola de una columna válida
+    peores = np.sort(np.partition(np.where(np.isnan(X), np.inf, X), k - 1, axis=0)[:k], axis=0)
+    acumulado = np.cumsum(peores, axis=0)
+
+    cols = np.arange(X.shape[1])
+    insuficiente = n < VAR_MIN_OBS
+    resultado = {}
+    for nivel, m in colas.items():
+        m = np.minimum(m, k)
+        var = -peores[m - 1, cols]
+        es = -acumulado[m - 1, cols] / m
+        resultado[nivel] = (np.where(insuficiente, np.nan, var), np.where(insuficiente, np.nan, es))
+    return resultado
+
+
+def var_es_parametrico(R, niveles=VAR_NIVELES, h=1):
+    """VaR/ES normales con media y desviación de la ventana diaria, escalados a h días"""
+    n = (~np.isnan(R)).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mu = np.nanmean(R, axis=0) * h
+        sigma = np.nanstd(R, axis=0, ddof=1) * np.sqrt(h)
+    insuficiente = n < VAR_MIN_OBS
+
+    normal = NormalDist()
+    resultado = {}
+    for nivel in niveles:
+        z = normal.inv_cdf(1 - nivel)
+        var = -(mu + z * sigma)
+        es = -(mu - sigma * normal.pdf(z) / (1 - nivel))
+        resultado[nivel] = (np.where(insuficiente, np.nan, var), np.where(insuficiente, np.nan, es))
+    return resultado
+
+
+def calcular_var_es(R, niveles=VAR_NIVELES, horizontes=VAR_HORIZONTES, ventana=VAR_VENTANA):
+    """
+    Todas las medidas para la última ventana de R (fechas × tickers):
+    {"historico"|"parametrico": {"95_1d": (var, es), ...}} con un arreglo por ticker.
+    """
+    R = R[-ventana:]
+    medidas = {"historico": {}, "parametrico": {}}
+    for h in horizontes:
+        historico = var_es_historico(rendimientos_horizonte(R, h), niveles)
+        parametrico = var_es_parametrico(R, niveles, h)
+        for nivel in niveles:
+            clave = f"{round(nivel * 100)}_{h}d"
+            medidas["historico"][clave] = historico[nivel]
+            medidas["parametrico"][clave] = parametrico[nivel]
+    return medidas
+
+
+def _var_es_columna(medidas, j, observaciones, fecha):
+    """Las medidas de una columna en el formato de estado_actual (porcentajes)"""
+    salida = {"fecha": fecha, "observaciones": int(observaciones)}
+    for metodo, por_clave in medidas.items():
+        salida[metodo] = {
+            clave: {"var_pct": var[j] * 100, "es_pct": es[j] * 100}
+            for clave, (var, es) in por_clave.items()
+        }
+    return salida
+
+
+def actualizar_var_es(data, rendimientos):
+    """
+    VaR/ES de cada empresa (estado_actual["var_es"]) y de la cartera que
+    implican las señales actuales (data["riesgo_cartera"]["var_es"]).
+    """
+    if rendimientos.empty:
+        return data
+    t0 = time.perf_counter()
+
+    tabla = rendimientos.tail(VAR_VENTANA)
+    R = tabla.to_numpy(dtype=float)
+    fecha = tabla.index[-1].date().isoformat()
+    medidas = calcular_var_es(R)
+    observaciones = (~np.isnan(R)).sum(axis=0)
+    columna = {tk: j for j, tk in enumerate(tabla.columns)}
+
+    for empresa in data["empresas"]:
+        j = columna.get(empresa["ticker"])
+        if j is not None and empresa.get("estado_actual"):
+            empresa["estado_actual"]["var_es"] = a_json_seguro(
+                _var_es_columna(medidas, j, observaciones[j], fecha))
+
+    # Cartera: rendimiento diario ponderado (un día sin dato cuenta como sin movimiento)
+    pesos = pesos_senales(data["empresas"])
+    w = np.array([pesos.get(tk, 0.0) for tk in tabla.columns])
+    if np.abs(w).sum() > 0:
+        w = w / np.abs(w).sum()
+        serie = (np.nan_to_num(R) @ w)[:, None]
+        cartera = _var_es_columna(calcular_var_es(serie), 0, len(serie), fecha)
+        cartera["posiciones"] = int((w != 0).sum())
+        data.setdefault("riesgo_cartera", {})["var_es"] = a_json_seguro(cartera)
+
+    print(f"📉 VaR/ES de {R.shape[1]} tickers en {(time.perf_counter() - t0) * 1000:.0f} ms")
+    return data
+
+
+# ========================================================
+#  MODO STREAMING (barras en vivo, señales intradía)
+# ========================================================
+import socket
+import argparse
+import contextlib
+from collections import deque
+
+# Barras cerradas que guardamos por ticker (MA_50 es la ventana más larga)
+STREAM_VENTANA = 50
+# Cada cuánto revisa el archivo en modo "tail" cuando no hay líneas nuevas
+STREAM_POLL_SEG = 0.2
+
+
+class EstadoIncremental:
+    """
+    Estado de indicadores de un ticker que se actualiza barra a barra.
+
+    Se siembra una vez con el DataFrame de prepare_advanced_data y después
+    cada barra cuesta O(STREAM_VENTANA): las EMAs (MACD y RSI de Wilder) se
+    llevan como estado y las medias/Bollinger salen de la ventana corta.
+
+    La barra del día en curso queda "abierta": cada tick la reemplaza y
+    solo se consolida cuando llega una barra con fecha posterior.
+    """
+
+    def __init__(self, ticker, df, model_accuracy=0, avg_error=0):
+        self.ticker = ticker
+        self.model_accuracy = model_accuracy
+        self.avg_error = avg_error
+
+        close = df['Close']
+        self.closes = deque(close.tail(STREAM_VENTANA).tolist(), maxlen=STREAM_VENTANA)
+        self.volumes = deque(df['Volume'].tail(20).tolist(), maxlen=20)
+        self.fecha = df.index[-1].date()
+
+        # Mismos parámetros que ta (adjust=False): MACD 12/26/9 y RSI alpha=1/14
+        diff = close.diff()
+        self.ema = {
+            'fast': close.ewm(span=12, adjust=False).mean().iloc[-1],
+            'slow': close.ewm(span=26, adjust=False).mean().iloc[-1],
+            'signal': df['MACD_signal'].iloc[-1],
+            'up': diff.clip(lower=0).ewm(alpha=1 / 14, adjust=False).mean().iloc[-1],
+            'dn': (-diff.clip(upper=0)).ewm(alpha=1 / 14, adjust=False).mean().iloc[-1],
+        }
+
+        # El predictor se entrena (si hace falta) una sola vez con la siembra
+        self.modelo = preparar_predictor(close.to_numpy(dtype=float), FORECAST_DAYS)
+
+        self.abierta = None       # (fecha, barra, ema) del periodo en curso
+        self.ultimo = None        # último resultado calculado
+
+    def _calcular(self, barra):
+        """Indicadores con la barra candidata, sin tocar el estado consolidado"""
+        c = float(barra['close'])
+        v = float(barra['volume'])
+        closes = np.append(np.fromiter(self.closes, dtype=float), c)
+        volumes = np.append(np.fromiter(self.volumes, dtype=float)[-19:], v)
+
+        ema = dict(self.ema)
+        ema['fast'] += (2 / 13) * (c - ema['fast'])
+        ema['slow'] += (2 / 27) * (c - ema['slow'])
+        macd = ema['fast'] - ema['slow']
+        ema['signal'] += (2 / 10) * (macd - ema['signal'])
+
+        d = c - closes[-2]
+        ema['up'] += (max(d, 0.0) - ema['up']) / 14
+        ema['dn'] += (max(-d, 0.0) - ema['dn']) / 14
+        rsi = 100.0 if ema['dn'] == 0 else 100 - 100 / (1 + ema['up'] / ema['dn'])
+
+        ventana_bb = closes[-20:]
+        bb_mid = ventana_bb.mean()
+        bb_std = ventana_bb.std()          # ddof=0, igual que ta
+        bb_upper = bb_mid + 2 * bb_std
+        bb_lower = bb_mid - 2 * bb_std
+
+        tech = {
+            'close': c,
+            'rsi': rsi,
+            'macd': macd,
+            'macd_signal': ema['signal'],
+            'macd_histogram': macd - ema['signal'],
+            'trend_5d': (c - closes[-5]) / closes[-5] * 100,
+            'trend_20d': (c - closes[-20]) / closes[-20] * 100,
+            'volatility': np.std(np.diff(closes[-11:]) / closes[-11:-1], ddof=1) * 100,
+            'volume_ratio': v / volumes.mean(),
+            'bb_position': (c - bb_lower) / (bb_upper - bb_lower),
+        }
+        return tech, closes, ema
+
+    def _consolidar(self):
+        fecha, barra, ema = self.abierta
+        self.closes.append(float(barra['close']))
+        self.volumes.append(float(barra['volume']))
+        self.ema = ema
+        self.fecha = fecha
+        self.abierta = None
+
+    def actualizar(self, barra):
+        """Aplica una barra y devuelve el dict de resultados (o None si es vieja)"""
+        fecha = pd.Timestamp(barra['fecha']).date()
+        if fecha <= self.fecha:
+            return None
+        if self.abierta is not None and fecha > self.abierta[0]:
+            self._consolidar()
+
+        tech, closes, ema = self._calcular(barra)
+        self.abierta = (fecha, barra, ema)
+
+        current_price = tech['close']
+        future_prices = self.modelo.predict(features_prediccion(closes), FORECAST_DAYS)[0].tolist()
+        signal, signal_strength, reasoning = evaluar_senal(
+            rsi=tech['rsi'],
+            price_change=(future_prices[-1] - current_price) / current_price * 100,
+            volume_ratio=tech['volume_ratio'],
+            macd=tech['macd'],
+            macd_signal_val=tech['macd_signal'],
+            macd_histogram=tech['macd_histogram'],
+            trend_5d=tech['trend_5d'],
+            trend_20d=tech['trend_20d'],
+            bb_position=tech['bb_position'],
+        )
+
+        self.ultimo = {
+            'signal': signal,
+            'current_price': current_price,
+            'future_prices': future_prices,
+            'signal_strength': signal_strength,
+            'reasoning': reasoning,
+            'risk_management': calculate_risk_management(current_price, future_prices, signal),
+            'model_accuracy': self.model_accuracy,
+            'avg_error': self.avg_error,
+            'predictor': etiqueta_predictor("ticker"),
+            'technical_analysis': {
+                'rsi': tech['rsi'],
+                'trend_5d': tech['trend_5d'],
+                'trend_20d': tech['trend_20d'],
+                'volatility': tech['volatility'],
+                'volume_ratio': tech['volume_ratio'],
+                'macd': tech['macd'],
+                'bb_position': tech['bb_position'],
+            },
+        }
+        return self.ultimo
+
+
+def leer_barras(fuente):
+    """
+    Genera barras (dicts) desde una fuente de texto con un JSON por línea:
+      "-"                  -> stdin (pipe)
+      "tcp://host:puerto"  -> socket local, una conexión a la vez
+      cualquier otra cosa  -> ruta de archivo leída en modo tail
+    Formato: {"ticker", "fecha", "open", "high", "low", "close", "volume"}
+    o {"evento": "cierre"} para terminar la sesión y escribir el snapshot.
+    """
+    def parsear(lineas):
+        for linea in lineas:
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                yield json.loads(linea)
+            except ValueError:
+                print(f"⚠️ Línea ignorada (JSON inválido): {linea[:80]}", file=sys.stderr)
+
+    if fuente == "-":
+        yield from parsear(sys.stdin)
+
+    elif fuente.startswith("tcp://"):
+        host, puerto = fuente[len("tcp://"):].rsplit(":", 1)
+        with socket.create_server((host, int(puerto))) as servidor:
+            while True:
+                conexion, _ = servidor.accept()
+                with conexion, conexion.makefile("r", encoding="utf-8") as f:
+                    for barra in parsear(f):
+                        yield barra
+                        if barra.get("evento") == "cierre":
+                            return
+
+    else:
+        with open(fuente, "r", encoding="utf-8") as f:
+            while True:
+                linea = f.readline()
+                if not linea:
+                    time.sleep(STREAM_POLL_SEG)
+                    continue
+                yield from parsear([linea])
+
+
+def ejecutar_streaming(fuente, tickers=tickers_a_procesar):
+    """Siembra el estado con la historia diaria y procesa barras hasta el cierre"""
+    global TICKER
+
+    estados = {}
+    ultimas_senales = {}
+
+    # Los reportes de la siembra van a stderr; stdout queda solo para señales
+    with contextlib.redirect_stdout(sys.stderr):
+        for tk in tickers:
+            TICKER = tk
+            df = prepare_advanced_data(tk)
+            res = get_trading_signal_with_predictions(df)
+            estados[tk] = EstadoIncremental(tk, df, res['model_accuracy'], res['avg_error'])
+            ultimas_senales[tk] = (res['signal'], res['signal_strength'])
+
+    print(f"📡 Escuchando barras en {fuente}...", file=sys.stderr)
+
+    for barra in leer_barras(fuente):
+        if barra.get("evento") == "cierre":
+            break
+
+        estado = estados.get(barra.get("ticker"))
+        if estado is None:
+            continue
+
+        t0 = time.perf_counter()
+        res = estado.actualizar(barra)
+        if res is None:
+            continue
+        latencia_ms = (time.perf_counter() - t0) * 1000
+
+        # Solo emitimos cuando cambia la señal o su fuerza
+        clave = (res['signal'], res['signal_strength'])
+        if clave != ultimas_senales[estado.ticker]:
+            ultimas_senales[estado.ticker] = clave
+            print(json.dumps({
+                "ticker": estado.ticker,
+                "fecha": str(barra["fecha"]),
+                "precio": limpiar_valor(res['current_price']),
+                "senal": res['signal'],
+                "fuerza": limpiar_valor(res['signal_strength']),
+                "razon": res['reasoning'],
+                "latencia_ms": round(latencia_ms, 3),
+            }, ensure_ascii=False), flush=True)
+
+    # Snapshot batch al cierre, igual que la corrida diaria. Todo lo que
+    # imprime va a stderr: stdout lleva solo las líneas JSON de señales
+    with contextlib.redirect_stdout(sys.stderr):
+        data = cargar_historial()
+        for tk, estado in estados.items():
+            if estado.ultimo is None:
+                continue
+            if estado.abierta is not None:
+                # La barra del día entra a la caché; semanal/mensual solo rehacen su periodo abierto
+                fecha, barra, _ = estado.abierta
+                c = float(barra['close'])
+                agregar_barras_diarias(tk, pd.DataFrame(
+                    [[float(barra.get('open', c)), float(barra.get('high', c)),
+                      float(barra.get('low', c)), c, float(barra['volume'])]],
+                    index=[pd.Timestamp(fecha)], columns=COLUMNAS_OHLCV))
+                estado.ultimo['multitemporal'] = confirmacion_multitemporal(tk, estado.ultimo['signal_strength'])
+            registrar_resultados(data, tk, estado.ultimo, tickers.get(tk))
+        data["screener"] = construir_screener(data["empresas"])
+        rendimientos = panel_rendimientos(tickers)
+        actualizar_riesgo_cartera(data, tickers, rendimientos=rendimientos)
+        actualizar_var_es(data, rendimientos)
+        compactar_historial(data)
+        guardar_historial(data)
+
+    print("\n📁 historial.json actualizado al cierre del stream (UTC)", file=sys.stderr)
+
+
+# ========================================================
+#  SERVICIO HTTP LOCAL (análisis bajo demanda)
+# ========================================================
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+SERVICIO_HOST = "127.0.0.1"
+SERVICIO_PUERTO = 8765
+# Tickers (o ticker@fecha) con barras/indicadores/predicciones calientes
+SERVICIO_CACHE_TICKERS = 64
+SERVICIO_CACHE_RESULTADOS = 512
+# Las barras de la fuente en vivo (y los análisis "al día") se refrescan pasado este tiempo
+SERVICIO_TTL_SEG = 900
+
+
+class CacheLRU:
+    """Dict acotado con desalojo LRU, seguro entre hilos; `al_desalojar(clave, valor)` opcional"""
+
+    def __init__(self, capacidad, al_desalojar=None):
+        self.capacidad = capacidad
+        self.al_desalojar = al_desalojar
+        self.datos = OrderedDict()
+        self.lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def get(self, clave):
+        with self.lock:
+            if clave not in self.datos:
+                self.fallos += 1
+                return None
+            self.aciertos += 1
+            self.datos.move_to_end(clave)
+            return self.datos[clave]
+
+    def put(self, clave, valor):
+        with self.lock:
+            self.datos[clave] = valor
+            self.datos.move_to_end(clave)
+            desalojados = []
+            while len(self.datos) > self.capacidad:
+                desalojados.append(self.datos.popitem(last=False))
+        if self.al_desalojar:
+            for k, v in desalojados:
+                self.al_desalojar(k, v)
+
+    def estadisticas(self):
+        return {"entradas": len(self.datos), "capacidad": self.capacidad,
+                "aciertos": self.aciertos, "fallos": self.fallos}
+
+
+class FuenteYahoo:
+    """Barras diarias de la caché en disco + yfinance (lo mismo que la corrida diaria)"""
+    en_vivo = True
+
+    def barras(self, ticker):
+        # Pasado el TTL el servicio vuelve a pedirlas: solo se descarga la cola
+        _barras_frescas.discard(ticker)
+        return cargar_barras_diarias(ticker)
+
+
+class FuenteReplay:
+    """
+    Barras locales para pruebas sin red: un directorio con <TICKER>.csv (el
+    formato de BARRAS_DIR) o un archivo JSONL con el formato del modo streaming.
+    """
+    en_vivo = False
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.frames = {}
+        if os.path.isfile(ruta):
+            with open(ruta, "r", encoding="utf-8") as f:
+                filas = [json.loads(linea) for linea in f if linea.strip()]
+            tabla = pd.DataFrame([b for b in filas if "ticker" in b])
+            tabla = tabla.rename(columns={c.lower(): c for c in COLUMNAS_OHLCV})
+            tabla["fecha"] = pd.to_datetime(tabla["fecha"])
+            for tk, grupo in tabla.groupby("ticker"):
+                self.frames[tk] = _normalizar_ohlcv(grupo.set_index("fecha"))
+
+    def barras(self, ticker):
+        if ticker not in self.frames and os.path.isdir(self.ruta):
+            archivo = os.path.join(self.ruta, f"{ticker}.csv")
+            if os.path.exists(archivo):
+                self.frames[ticker] = _normalizar_ohlcv(
+                    pd.read_csv(archivo, index_col=0, parse_dates=True, float_precision="round_trip"))
+        if ticker not in self.frames:
+            raise LookupError(f"{ticker} no está en {self.ruta}")
+        return self.frames[ticker]
+
+
+class ServicioAnalisis:
+    """
+    Análisis bajo demanda con todo caliente en memoria: barras por ticker,
+    DataFrames de indicadores y predicciones/modelos (las cachés globales de
+    la corrida, desalojadas por LRU), más los resultados ya calculados.
+
+    Las peticiones simultáneas por la misma clave (ticker, fecha, predictor)
+    esperan un solo cálculo. Los cálculos (incluida la carga de barras) van
+    de uno en uno porque el pipeline usa globales (TICKER, PREDICTOR, cachés)
+    y es CPU bajo el GIL.
+    """
+
+    def __init__(self, fuente=None, capacidad=SERVICIO_CACHE_TICKERS,
+                 capacidad_resultados=SERVICIO_CACHE_RESULTADOS, ttl=SERVICIO_TTL_SEG):
+        self.fuente = fuente or FuenteYahoo()
+        self.ttl = ttl
+        self.barras = CacheLRU(capacidad)
+        self.indicadores = CacheLRU(capacidad, al_desalojar=self._soltar_globales)
+        self.resultados = CacheLRU(capacidad_resultados)
+        self.en_vuelo = {}
+        self.lock_vuelo = threading.Lock()
+        self.lock_calculo = threading.Lock()
+        self.calculos = 0
+        self.inicio = time.time()
+
+    @staticmethod
+    def _soltar_globales(clave, _):
+        clave_tk = clave[0]
+        liberar_cache_tickers([clave_tk])
+        if "@" in clave_tk:
+            _barras_frescas.discard(clave_tk)
+
+    def _barras(self, ticker):
+        entrada = self.barras.get(ticker)
+        if entrada is None or (self.fuente.en_vivo and time.time() - entrada[0] > self.ttl):
+            entrada = (time.time(), self.fuente.barras(ticker))
+            self.barras.put(ticker, entrada)
+        return entrada[1]
+
+    def analizar(self, ticker, fecha=None, predictor=None):
+        """Resultados de get_trading_signal_with_predictions con las barras hasta `fecha` (incluida)"""
+        ticker = ticker.upper()
+        fecha = pd.Timestamp(fecha).date().isoformat() if fecha else None
+        predictor = predictor or PREDICTOR
+        if predictor not in PREDICTORES:
+            raise ValueError(f"predictor desconocido: {predictor}")
+        clave = (ticker, fecha, predictor)
+
+        entrada = self.resultados.get(clave)
+        # Un análisis "al día" caduca con las barras; uno con fecha no cambia
+        if entrada is not None and (fecha or time.time() - entrada[0] <= self.ttl):
+            return entrada[1], "hit"
+
+        with self.lock_vuelo:
+            futuro = self.en_vuelo.get(clave)
+            lider = futuro is None
+            if lider:
+                futuro = self.en_vuelo[clave] = Future()
+        if not lider:
+            return futuro.result(), "coalescida"
+
+        try:
+            resultado = self._calcular(ticker, fecha, predictor)
+            self.resultados.put(clave, (time.time(), resultado))
+            futuro.set_result(resultado)
+            return resultado, "miss"
+        except Exception as e:
+            futuro.set_exception(e)
+            raise
+        finally:
+            with self.lock_vuelo:
+                del self.en_vuelo[clave]
+
+    def _calcular(self, ticker, fecha, predictor):
+        global TICKER, PREDICTOR
+
+        # Clave propia para "a fecha D": no se mezcla en cachés con el análisis al día
+        clave_tk = ticker if fecha is None else f"{ticker}@{fecha}"
+
+        with self.lock_calculo:
+            # También la carga de barras: FuenteYahoo escribe en _barras_diarias,
+            # _barras_frescas y _cache_remuestreo, igual que el cálculo
+            barras = self._barras(ticker)
+            if fecha:
+                barras = barras[barras.index <= pd.Timestamp(fecha)]
+
+            self.calculos += 1
+            clave_ind = (clave_tk, barras.index[-1] if len(barras) else None)
+            df = self.indicadores.get(clave_ind)
+            if df is None:
+                df = calcular_indicadores(barras)
+                self.indicadores.put(clave_ind, df)
+            if len(df) < MIN_FILAS_SENAL:
+                raise LookupError(f"{ticker}: solo {len(df)} filas con indicadores hasta {fecha or 'hoy'}")
+
+            # Semanal/mensual salen de estas mismas barras, sin red
+            agregar_barras_diarias(clave_tk, barras)
+            _barras_frescas.add(clave_tk)
+
+            anterior = PREDICTOR
+            TICKER, PREDICTOR = clave_tk, predictor
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    resultados = get_trading_signal_with_predictions(df)
+            finally:
+                PREDICTOR = anterior
+
+        resultados["ticker"] = ticker
+        resultados["fecha_barra"] = df.index[-1].date().isoformat()
+        return a_json_seguro(resultados)
+
+    def salud(self):
+        return {
+            "activo_seg": round(time.time() - self.inicio, 1),
+            "fuente": type(self.fuente).__name__,
+            "calculos": self.calculos,
+            "en_vuelo": len(self.en_vuelo),
+            "barras": self.barras.estadisticas(),
+            "indicadores": self.indicadores.estadisticas(),
+            "resultados": self.resultados.estadisticas(),
+        }
+
+
+class ManejadorAnalisis(BaseHTTPRequestHandler):
+    """
+    GET /analisis/<TICKER>[?fecha=AAAA-MM-DD&predictor=...]  -> resultados completos
+    GET /senal/<TICKER>[?fecha=...&predictor=...]            -> solo la señal
+    GET /salud                                               -> estado de las cachés
+    """
+
+    def _responder(self, codigo, cuerpo):
+        datos = json_compacto(cuerpo).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_GET(self):
+        servicio = self.server.servicio
+        url = urlparse(self.path)
+        partes = [p for p in url.path.split("/") if p]
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        if partes == ["salud"]:
+            return self._responder(200, servicio.salud())
+        if len(partes) != 2 or partes[0] not in ("analisis", "senal"):
+            return self._responder(404, {"error": f"ruta desconocida: {url.path}"})
+
+        t0 = time.perf_counter()
+        try:
+            resultado, cache = servicio.analizar(partes[1], params.get("fecha"), params.get("predictor"))
+        except LookupError as e:
+            return self._responder(404, {"error": str(e)})
+        except ValueError as e:
+            return self._responder(400, {"error": str(e)})
+        except Exception as e:
+            return self._responder(500, {"error": f"{type(e).__name__}: {e}"})
+
+        if partes[0] == "senal":
+            resultado = {
+                "ticker": resultado["ticker"],
+                "fecha_barra": resultado["fecha_barra"],
+                "precio": resultado["current_price"],
+                "senal": resultado["signal"],
+                "fuerza": resultado["signal_strength"],
+                "razon": resultado["reasoning"],
+                "predictor": resultado["predictor"],
+                "confirmacion_multitemporal": resultado.get("multitemporal"),
+            }
+        return self._responder(200, {**resultado, "cache": cache,
+                                     "tiempo_ms": round((time.perf_counter() - t0) * 1000, 3)})
+
+    def log_message(self, formato, *args):
+        print(f"🌐 {self.address_string()} {formato % args}", file=sys.stderr)
+
+
+def crear_servidor(direccion=(SERVICIO_HOST, SERVICIO_PUERTO), servicio=None):
+    servidor = ThreadingHTTPServer(direccion, ManejadorAnalisis)
+    servidor.daemon_threads = True
+    servidor.servicio = servicio or ServicioAnalisis()
+    return servidor
+
+
+def ejecutar_servicio(direccion, replay=None):
+    fuente = FuenteReplay(replay) if replay else FuenteYahoo()
+    servidor = crear_servidor(direccion, ServicioAnalisis(fuente))
+    host, puerto = servidor.server_address[:2]
+    print(f"🌐 Servicio de análisis en http://{host}:{puerto} (fuente: {type(fuente).__name__})",
+          file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+# ========================================================
+#  EJECUCIÓN GENERAL
+# ========================================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Actualiza public/historial.json")
+    parser.add_argument(
+        "--stream",
+        metavar="FUENTE",
+        help='consumir barras en vivo: "-" (stdin), "tcp://host:puerto" o ruta de archivo (tail)',
+    )
+    parser.add_argument(
+        "--servir",
+        metavar="[HOST:]PUERTO",
+        nargs="?",
+        const=str(SERVICIO_PUERTO),
+        help=f"servicio HTTP local de análisis bajo demanda (por defecto {SERVICIO_HOST}:{SERVICIO_PUERTO})",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="RUTA",
+        help="con --servir: barras locales (directorio de CSV o JSONL) en lugar de yfinance",
+    )
+    parser.add_argument(
+        "--predictor",
+        choices=sorted(PREDICTORES),
+        default=PREDICTOR,
+        help=f"modelo de predicción (por defecto: {PREDICTOR})",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="reanudar la corrida de hoy procesando solo los tickers que faltan",
+    )
+    parser.add_argument(
+        "--lote",
+        type=int,
+        default=PIPELINE_LOTE,
+        help=f"tickers por lote del pipeline (por defecto {PIPELINE_LOTE})",
+    )
+    parser.add_argument(
+        "--memoria-mb",
+        type=float,
+        default=PIPELINE_MEMORIA_MB,
+        help=f"presupuesto de RSS en MB; al rebasarlo se achican los lotes (por defecto {PIPELINE_MEMORIA_MB})",
+    )
+    parser.add_argument(
+        "--compactar",
+        action="store_true",
+        help="solo aplicar la política de retención/resúmenes al historial existente",
+    )
+    parser.add_argument(
+        "--bench-serializacion",
+        metavar="N",
+        type=int,
+        nargs="?",
+        const=5000,
+        help="comparar la serialización anterior contra la actual con N empresas (5000)",
+    )
+    parser.add_argument(
+        "--backtest",
+        action="store_true",
+        help="reproducir señales y reglas de stop/take profit sobre toda la historia",
+    )
+    args = parser.parse_args()
+    PREDICTOR = args.predictor
+
+    if args.bench_serializacion:
+        benchmark_serializacion(args.bench_serializacion)
+    elif args.stream:
+        ejecutar_streaming(args.stream)
+    elif args.servir:
+        host, _, puerto = args.servir.rpartition(":")
+        ejecutar_servicio((host or SERVICIO_HOST, int(puerto)), args.replay)
+    elif args.compactar:
+        data = compactar_historial(cargar_historial())
+        guardar_historial(data)
+    elif args.backtest:
+        resultado = ejecutar_backtest(descargar_panel(tickers_a_procesar))
+
+        print(f"\n📊 BACKTEST {resultado['desde']} → {resultado['hasta']}")
+        print(f"   Operaciones: {resultado['operaciones']}")
+        print(f"   Tasa de aciertos: {resultado['tasa_aciertos_pct']}%")
+        print(f"   Retorno total: {resultado['retorno_total_pct']:+.2f}%")
+        print(f"   Máx. drawdown: {resultado['max_drawdown_pct']:.2f}%")
+
+        data = cargar_historial()
+        data["backtest"] = resultado
+        guardar_historial(data)
+    else:
+        manifiesto = ejecutar_corrida(tickers_a_procesar, reanudar=args.resume,
+                                      lote=args.lote, memoria_mb=args.memoria_mb)
+
+        pendientes = [tk for tk, e in manifiesto["tickers"].items() if e["estado"] == "error"]
+        if pendientes:
+            print(f"\n⚠️ Con error: {', '.join(pendientes)} (reintentar con --resume)")
+            sys.exit(1)
+
+        print("\n📁 historial.json actualizado con TODAS las empresas (UTC)")